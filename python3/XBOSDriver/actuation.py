@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import functools
+
+logger = logging.getLogger('driver')
+
+class ActuationQueue(object):
+    """
+    Serializes the writes of one actuator. Of the actuation messages arriving while a write is
+    waiting or in progress, only the latest is kept, so a burst of schedule or override
+    messages results in one write of the newest value instead of one per message. Writes
+    start at least min_interval seconds apart. Coroutine callbacks run on the event loop,
+    other callbacks in the given executor, so that blocking device writes stay off the loop
+    """
+    def __init__(self, executor, callback, args=(), min_interval=0):
+        self._executor = executor
+        self.callback = callback
+        self.args = args
+        self.min_interval = min_interval
+        # newest message not written yet
+        self.pending = None
+        self.writes = 0
+        # messages superseded by a newer one before being written
+        self.dropped = 0
+        # seconds the last write took, and the longest one
+        self.latency = None
+        self.max_latency = 0
+        self._loop = None
+        self._task = None
+        # loop time the last write started
+        self._last = None
+
+    def __repr__(self):
+        return "<ActuationQueue writes={0} dropped={1} latency={2}>".format(self.writes, self.dropped, self.latency)
+
+    def put(self, msg):
+        """
+        Queues an actuation message (called on the event loop, e.g. by a subscription)
+        """
+        if not isinstance(msg, dict) or 'Readings' not in msg:
+            # carries no value to write
+            return
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = msg
+        if self._task is None:
+            self._loop = asyncio.get_event_loop()
+            self._task = self._loop.create_task(self._drain())
+
+    @asyncio.coroutine
+    def _drain(self):
+        try:
+            while self.pending is not None:
+                if self._last is not None:
+                    wait = self._last + self.min_interval - self._loop.time()
+                    if wait > 0:
+                        yield from asyncio.sleep(wait)
+                msg, self.pending = self.pending, None
+                self._last = self._loop.time()
+                try:
+                    if asyncio.iscoroutinefunction(self.callback):
+                        yield from self.callback(msg, *self.args)
+                    else:
+                        yield from self._loop.run_in_executor(self._executor, functools.partial(self.callback, msg, *self.args))
+                except Exception:
+                    logger.exception("Actuation {0} failed".format(getattr(self.callback, '__qualname__', self.callback)))
+                self.latency = self._loop.time() - self._last
+                self.max_latency = max(self.max_latency, self.latency)
+                self.writes += 1
+        finally:
+            self._task = None
@@ -0,0 +1,171 @@
+from array import array
+
+# columns a buffer grows to from empty
+MIN_CAPACITY = 8
+
+_NO_TIMES = array('q')
+_NO_VALUES = array('d')
+
+class Readings(object):
+    """
+    Zero-copy view of a range of a NumericBuffer's columns. XBOSDriver.serializer encodes it
+    as a list of [time, value] pairs straight from the columns. Since trimming shifts the
+    buffer in place, a view is only meaningful until the buffer is next trimmed
+    """
+    __slots__ = ('times', 'values')
+
+    def __init__(self, times, values):
+        self.times = times
+        self.values = values
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return zip(self.times, self.values)
+
+    def __repr__(self):
+        return "<Readings {0}>".format(len(self))
+
+class NumericBuffer(object):
+    """
+    Buffer of uncommitted readings for a numeric timeseries. Timestamps and values
+    are kept in two preallocated typed columns (int64 and double) instead of one
+    [time, value] list per reading. A buffer created with capacity 0 allocates its columns
+    with the first reading, so timeseries that are never written to cost no column space
+    """
+    __slots__ = ('_times', '_values', '_len', 'start_seq')
+
+    def __init__(self, capacity=16):
+        if capacity:
+            self._times = array('q', bytes(8 * capacity))
+            self._values = array('d', bytes(8 * capacity))
+        else:
+            # shared by all empty buffers; never written to, since _grow replaces them
+            self._times, self._values = _NO_TIMES, _NO_VALUES
+        # number of slots of the columns holding readings
+        self._len = 0
+        # sequence number of the first buffered reading
+        self.start_seq = 0
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def end_seq(self):
+        """
+        Sequence number the next reading will get
+        """
+        return self.start_seq + self._len
+
+    def _grow(self, needed):
+        """
+        Replaces the columns with larger copies. The old arrays are never resized
+        in place, so views handed out by times/values stay valid
+        """
+        capacity = max(2 * len(self._times), needed, MIN_CAPACITY)
+        times = self._times[:self._len]
+        times.frombytes(bytes(8 * (capacity - self._len)))
+        values = self._values[:self._len]
+        values.frombytes(bytes(8 * (capacity - self._len)))
+        self._times, self._values = times, values
+
+    def append(self, time, value):
+        n = self._len
+        if n == len(self._times):
+            self._grow(n + 1)
+        self._times[n] = int(time)
+        self._values[n] = value
+        self._len = n + 1
+
+    def extend(self, times, values):
+        """
+        Appends a batch of readings. times and values are arrays of typecode 'q' and 'd'
+        of the same length
+        """
+        n, m = self._len, len(values)
+        if n + m > len(self._times):
+            self._grow(n + m)
+        self._times[n:n + m] = times
+        self._values[n:n + m] = values
+        self._len = n + m
+
+    @property
+    def times(self):
+        """
+        Zero-copy view of the buffered timestamps
+        """
+        return memoryview(self._times)[:self._len]
+
+    @property
+    def values(self):
+        """
+        Zero-copy view of the buffered values
+        """
+        return memoryview(self._values)[:self._len]
+
+    def readings(self, start=None, end=None):
+        """
+        Returns the readings numbered [start, end) as a zero-copy Readings view.
+        Defaults to everything buffered
+        """
+        i = 0 if start is None else start - self.start_seq
+        j = self._len if end is None else end - self.start_seq
+        return Readings(self.times[i:j], self.values[i:j])
+
+    def trim(self, seq):
+        """
+        Drops the readings numbered below seq
+        """
+        count = min(seq - self.start_seq, self._len)
+        if count <= 0:
+            return
+        rest = self._len - count
+        # shift through memoryviews: slice assignment on the arrays themselves is refused
+        # while a Readings view of them is still alive
+        self.times[:rest] = self.times[count:]
+        self.values[:rest] = self.values[count:]
+        self._len = rest
+        self.start_seq += count
+
+    def clear(self):
+        self.trim(self.end_seq)
+
+class ObjectBuffer(object):
+    """
+    Buffer of uncommitted readings for an object timeseries: a list of [time, value] pairs
+    """
+    __slots__ = ('_readings', 'start_seq')
+
+    def __init__(self):
+        self._readings = []
+        # sequence number of the first buffered reading
+        self.start_seq = 0
+
+    def __len__(self):
+        return len(self._readings)
+
+    @property
+    def end_seq(self):
+        return self.start_seq + len(self._readings)
+
+    def append(self, time, value):
+        self._readings.append([time, value])
+
+    def extend(self, times, values):
+        self._readings.extend([t, v] for t, v in zip(times, values))
+
+    def readings(self, start=None, end=None):
+        i = 0 if start is None else start - self.start_seq
+        j = len(self._readings) if end is None else end - self.start_seq
+        return self._readings[i:j]
+
+    def trim(self, seq):
+        count = min(seq - self.start_seq, len(self._readings))
+        if count <= 0:
+            return
+        del self._readings[:count]
+        self.start_seq += count
+
+    def clear(self):
+        self.trim(self.end_seq)
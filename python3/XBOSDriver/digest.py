@@ -0,0 +1,79 @@
+import os
+import re
+import asyncio
+import hashlib
+import binascii
+from urllib.parse import urlsplit
+
+# key="quoted value" or key=token pairs of a WWW-Authenticate header
+CHALLENGE_PARAM = re.compile(r'(\w+)=(?:"([^"]*)"|([^\s,]*))')
+
+def _md5(*parts):
+    return hashlib.md5(':'.join(parts).encode('utf-8')).hexdigest()
+
+class DigestAuthClient(object):
+    """
+    HTTP client for devices behind digest authentication (RFC 2617), on top of a pooled aiohttp
+    ClientSession. The challenge of the first 401 is kept, so later requests authenticate up
+    front instead of paying an extra round-trip each. At most concurrency requests are in
+    flight at once, since embedded web servers tend to fall over under parallel load
+    """
+    def __init__(self, session, user, password, concurrency=4):
+        self._session = session
+        self.user = user
+        self.password = password
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # parameters of the last digest challenge
+        self._challenge = None
+        # nonce count for the current challenge
+        self._nc = 0
+
+    def _authorization(self, method, url):
+        parts = urlsplit(url)
+        uri = parts.path + ('?' + parts.query if parts.query else '')
+        challenge = self._challenge
+        realm, nonce = challenge.get('realm', ''), challenge.get('nonce', '')
+        ha1 = _md5(self.user, realm, self.password)
+        ha2 = _md5(method, uri)
+        fields = [('username', self.user), ('realm', realm), ('nonce', nonce), ('uri', uri)]
+        if 'auth' in challenge.get('qop', '').split(','):
+            self._nc += 1
+            nc = '{0:08x}'.format(self._nc)
+            cnonce = binascii.hexlify(os.urandom(8)).decode()
+            fields.append(('response', _md5(ha1, nonce, nc, cnonce, 'auth', ha2)))
+            extra = ', qop=auth, nc={0}, cnonce="{1}"'.format(nc, cnonce)
+        else:
+            fields.append(('response', _md5(ha1, nonce, ha2)))
+            extra = ''
+        if 'opaque' in challenge:
+            fields.append(('opaque', challenge['opaque']))
+        if 'algorithm' in challenge:
+            extra += ', algorithm={0}'.format(challenge['algorithm'])
+        return 'Digest ' + ', '.join('{0}="{1}"'.format(k, v) for k, v in fields) + extra
+
+    @asyncio.coroutine
+    def get(self, url, timeout=10):
+        """
+        GETs url, answering a digest challenge if needed. Returns (status, body bytes)
+        """
+        yield from self._semaphore.acquire()
+        try:
+            for attempt in range(2):
+                headers = {}
+                if self._challenge is not None:
+                    headers['Authorization'] = self._authorization('GET', url)
+                response = yield from asyncio.wait_for(self._session.get(url, headers=headers), timeout)
+                try:
+                    challenge = response.headers.get('WWW-Authenticate', '')
+                    if response.status == 401 and attempt == 0 and challenge.startswith('Digest'):
+                        # new or stale nonce: authenticate against it and retry once
+                        self._challenge = {m.group(1): m.group(2) if m.group(2) is not None else m.group(3)
+                                           for m in CHALLENGE_PARAM.finditer(challenge)}
+                        self._nc = 0
+                        continue
+                    body = yield from asyncio.wait_for(response.read(), timeout)
+                    return response.status, body
+                finally:
+                    yield from response.release()
+        finally:
+            self._semaphore.release()
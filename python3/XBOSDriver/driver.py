@@ -1,9 +1,11 @@
 import asyncio
-import socket
-import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from array import array
 import uuid
 import aiohttp
 import logging
+from datetime import datetime
 from tabulate import tabulate
 logging.basicConfig(format='%(levelname)s:%(asctime)s %(name)s %(message)s', level=logging.INFO)
 logger = logging.getLogger('driver')
@@ -12,14 +14,77 @@ logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
 
 from XBOSDriver.timeseriestypes import UNIT_TIMES, STREAM_TYPES, UNIT_TIME_MAP
 from XBOSDriver.timeseriestypes import STREAM_TYPE_NUMERIC
-from XBOSDriver.exceptions import ValidationException, TimestampException, TimeseriesException
-from XBOSDriver.subscribe import Subscriber
+from XBOSDriver.exceptions import ValidationException, TimestampException, TimeseriesException, SmapSocketException
+from XBOSDriver.subscribe import SubscriptionManager
+from XBOSDriver.buffer import NumericBuffer, ObjectBuffer
+from XBOSDriver.outbound import Destination, FlushPolicy
+import XBOSDriver.outbound as outbound
+from XBOSDriver.spill import SpillFile
 import XBOSDriver.util as util
+import XBOSDriver.serializer as serializer
+from XBOSDriver.scheduler import Ticker, jittered_phase
+from XBOSDriver.actuation import ActuationQueue
+from XBOSDriver.listener import DatagramListener, StreamListener
 
 BINARY_ACTUATOR = 'binary'
 CONTINUOUS_ACTUATOR = 'continuous'
 
+def make_session(config, loop=None):
+    """
+    Creates the aiohttp ClientSession a driver uses for reports, subscriptions and device I/O.
+    Connections are kept alive and reused, and DNS lookups are cached. max_connections (in
+    total) and connections_per_host of 0 mean no limit; note that every subscription holds one
+    connection open, so a limit shared by many instances has to leave room for all of them
+    """
+    connector = aiohttp.TCPConnector(limit=int(config.get('max_connections', 0)),
+                                     limit_per_host=int(config.get('connections_per_host', 0)),
+                                     keepalive_timeout=float(config.get('keepalive_timeout', 30)),
+                                     use_dns_cache=True,
+                                     ttl_dns_cache=int(config.get('dns_cache_ttl', 300)),
+                                     loop=loop)
+    return aiohttp.ClientSession(connector=connector, loop=loop)
+
+# (unit of measure, unit of time, stream type) -> Properties block, shared by every timeseries
+# with that combination
+_properties = {}
+
+def _shared_properties(unit_measure, unit_time, stream_type):
+    key = (unit_measure, unit_time, stream_type)
+    properties = _properties.get(key)
+    if properties is None:
+        properties = {
+            'UnitofTime': UNIT_TIME_MAP[unit_time],
+            'UnitofMeasure': unit_measure,
+            'StreamType': stream_type
+        }
+        if stream_type == STREAM_TYPE_NUMERIC:
+            properties['ReadingType'] = 'double' # sane default. No need for long
+        properties = _properties.setdefault(key, properties)
+    return properties
+
+class Actuator(object):
+    """
+    Actuator of a timeseries, set by Timeseries.attach_actuator
+    """
+    __slots__ = ('uuid', 'model', 'states', 'range', 'callback', 'args', 'queue')
+
+    def __init__(self, uuid, model, states=None, range=None, callback=None, args=()):
+        self.uuid = uuid
+        self.model = model
+        self.states = states
+        self.range = range
+        self.callback = callback
+        self.args = args
+        # ActuationQueue the actuator is written through, set by Driver.attach_actuator
+        self.queue = None
+
+    def __repr__(self):
+        return "<Actuator uuid={0} Model={1}>".format(self.uuid, self.model)
+
 class Timeseries(object):
+    __slots__ = ('path', 'uuid', 'unit_measure', 'unit_time', 'stream_type', 'buffer', 'properties',
+                 'metadata', 'version', 'actuator', 'spill')
+
     def __init__(self, path, ts_uuid, unit_measure, unit_time, stream_type):
         # validate
         Timeseries._validate_unit_measure(unit_measure)
@@ -29,27 +94,47 @@ class Timeseries(object):
         # add to instance variables
         # the path of this timeseries
         self.path = path
-        # buffer of uncommitted readings
-        self.buffer = []
         # the unique identifier for this timeseries
         self.uuid = ts_uuid
         # properties for this timeseries
         self.unit_measure = unit_measure
         self.unit_time = unit_time
         self.stream_type = stream_type
-        self.properties = {
-            'UnitofTime': UNIT_TIME_MAP[self.unit_time],
-            'UnitofMeasure': self.unit_measure,
-            'StreamType': self.stream_type
-        }
+        # buffer of uncommitted readings. Numeric columns are allocated with the first reading
         if self.stream_type == STREAM_TYPE_NUMERIC:
-            self.properties['ReadingType'] = 'double' # sane default. No need for long
+            self.buffer = NumericBuffer(capacity=0)
+        else:
+            self.buffer = ObjectBuffer()
+        # shared with the other timeseries of the same units and type; never modified in place
+        self.properties = _shared_properties(unit_measure, unit_time, stream_type)
         # metadata for this timeseries
         self.metadata = {}
-        # whether or not there is metadata/properties that have yet to be committed
-        self.dirty = True
-        # if this stream is an actuator
-        self.has_actuator = False
+        # bumped on every metadata/properties change; report destinations compare it
+        # against the version they last acknowledged
+        self.version = 0
+        # Actuator record if this stream is an actuator, else None
+        self.actuator = None
+        # SpillFile that takes new readings while the driver has too many buffered in memory
+        self.spill = None
+
+    @property
+    def has_actuator(self):
+        return self.actuator is not None
+
+    @property
+    def actuation(self):
+        """
+        ActuationQueue of the actuator, if any
+        """
+        return self.actuator.queue if self.actuator is not None else None
+
+    @property
+    def actuator_uuid(self):
+        return self.actuator.uuid if self.actuator is not None else None
+
+    @property
+    def actuator_model(self):
+        return self.actuator.model if self.actuator is not None else None
 
     def __repr__(self):
         return "<Timeseries Path={path} UnitofMeasure={uom} UnitofTime={uot} StreamType={st}".format(
@@ -83,6 +168,38 @@ class Timeseries(object):
             if not isinstance(value, (int, float)):
                 raise ValidationException("Value {0} is not of type STREAM_TYPE_NUMERIC".format(value))
 
+    def _validate_values(self, values):
+        """
+        Validates a whole column of values at once and returns it in the form the buffer stores.
+        Accepts any sequence or a NumPy array
+        """
+        if self.stream_type != STREAM_TYPE_NUMERIC:
+            return list(values)
+        dtype = getattr(values, 'dtype', None)
+        if dtype is not None: # NumPy array
+            if dtype.kind not in 'biuf':
+                raise ValidationException("Array of dtype {0} is not of type STREAM_TYPE_NUMERIC".format(dtype))
+            return array('d', values.astype('d').tobytes())
+        try:
+            return array('d', values)
+        except TypeError:
+            raise ValidationException("Values {0} are not all of type STREAM_TYPE_NUMERIC".format(values))
+
+    def _validate_times(self, times, count):
+        """
+        Returns a column of count timestamps. times is either a sequence (or NumPy array) of
+        timestamps or a single timestamp shared by the whole batch
+        """
+        if isinstance(times, (int, float)):
+            times = array('q', [int(times)]) * count
+        elif getattr(times, 'dtype', None) is not None: # NumPy array
+            times = array('q', times.astype('q').tobytes())
+        else:
+            times = array('q', [int(t) for t in times])
+        if len(times) != count:
+            raise TimestampException("Got {0} timestamps for {1} values".format(len(times), count))
+        return times
+
     def add(self, value, time=None):
         """
         Queues the given value to be sent to the archiver
@@ -92,56 +209,176 @@ class Timeseries(object):
         self._validate_value(value)
         if time is None:
             time = util.get_current_time_as(self.unit_time)
-        self.buffer.append([time, value])
+        self._store(time, value)
 
-    def get_report(self):
+    def _store(self, time, value):
         """
-        Returns a JSON-serializable, sMAP-profile message containing all the metadata and readings
-        to be sent to archiver
+        Queues an already validated reading
         """
-        report = {"uuid": self.uuid, "Readings": self.buffer}
-        if self.dirty:
-            #TODO: just send the "diff"
-            report["Properties"] = self.properties
-            report["Metadata"] = self.metadata
-            if self.has_actuator:
-                report["Actuator"] = {"uuid": self.actuator_uuid, "Model": self.actuator_model}
-        return report
+        if self.spill is not None and self.spill.active:
+            self.spill.append(self, time, value)
+        else:
+            self.buffer.append(time, value)
+
+    def extend(self, values, times=None):
+        """
+        Queues a batch of values to be sent to the archiver. times is a sequence with one
+        timestamp per value, a single timestamp for the whole batch, or None to stamp the
+        batch with the current time
+        """
+        values = self._validate_values(values)
+        if times is None:
+            times = util.get_current_time_as(self.unit_time)
+        self._store_many(self._validate_times(times, len(values)), values)
+
+    def _store_many(self, times, values):
+        """
+        Queues already validated columns of timestamps and values
+        """
+        if self.spill is not None and self.spill.active:
+            for time, value in zip(times, values):
+                self.spill.append(self, time, value)
+        else:
+            self.buffer.extend(times, values)
 
-    def clear_report(self):
+    def metadata_blocks(self):
+        blocks = {"Properties": self.properties, "Metadata": self.metadata}
+        if self.actuator is not None:
+            blocks["Actuator"] = {"uuid": self.actuator.uuid, "Model": self.actuator.model}
+        return blocks
+
+    def get_report(self, start=None, end=None, committed=None):
         """
-        Clears the local buffer of uncommitted readings
+        Returns a JSON-serializable, sMAP-profile message containing the readings numbered
+        [start, end) (default: all buffered readings) and the metadata to be sent to archiver.
+        committed is the (version, blocks) pair the destination last acknowledged: only the
+        Properties/Metadata/Actuator keys that changed since are included. If it is None,
+        the full blocks are sent
         """
-        #TODO: only clear since last write
-        self.buffer = []
-        self.dirty = False
+        report = {"uuid": self.uuid, "Readings": self.buffer.readings(start, end)}
+        if committed is None:
+            report.update(self.metadata_blocks())
+        elif committed[0] != self.version:
+            for key, block in self.metadata_blocks().items():
+                delta = util.dict_diff(block, committed[1].get(key, {}))
+                if delta:
+                    report[key] = delta
+        return report
 
     def attach_metadata(self, metadata):
         """
         Attaches metadata to this timeseries following update/insert policy
         """
         self.metadata = util.dict_merge(metadata, self.metadata)
-        self.dirty = True
+        self.version += 1
 
-    def attach_actuator(self, kind=None, states=None, range=None):
-        if self.has_actuator:
+    def attach_actuator(self, kind=None, states=None, range=None, callback=None, args=()):
+        """
+        Makes this timeseries an actuator and returns its Actuator record
+        """
+        if self.actuator is not None:
             raise ValidationException("Path {0} already has an actuator".format(self.path))
         if kind not in [BINARY_ACTUATOR, CONTINUOUS_ACTUATOR]:
             raise ValidationException("Actuator must be Binary or Continuous")
-        self.actuator_uuid = str(uuid.uuid5(uuid.UUID(self.uuid), self.path+'_act'))
+        self.actuator = Actuator(str(uuid.uuid5(uuid.UUID(self.uuid), self.path+'_act')), kind, states, range, callback, args)
+        self.version += 1
+        return self.actuator
+
+class TimeseriesHandle(object):
+    """
+    Returned by Driver.add_timeseries. Bound to the Timeseries, so readings added through it
+    skip building the path and looking it up; it compares and hashes equal to its path, so it
+    can be used wherever the driver takes a path, e.g. as a key of add_many readings
+    """
+    __slots__ = ('path', 'uuid', 'timeseries', '_driver')
+
+    def __init__(self, driver, timeseries):
+        self.path = timeseries.path
+        self.uuid = timeseries.uuid
+        self.timeseries = timeseries
+        self._driver = driver
+
+    def __eq__(self, other):
+        if isinstance(other, TimeseriesHandle):
+            return self.path == other.path
+        return self.path == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return "<TimeseriesHandle {0}>".format(self.path)
+
+    def add(self, value, time=None):
+        """
+        Queues a reading, as Driver.add
+        """
+        self._driver._add(self.timeseries, value, time)
+
+    def extend(self, values, times=None):
+        """
+        Queues a batch of values, as Timeseries.extend
+        """
+        ts = self.timeseries
+        values = ts._validate_values(values)
+        if times is None:
+            times = util.get_current_time_as(ts.unit_time)
+        batch = [(ts, ts._validate_times(times, len(values)), values)]
+        if self._driver._off_loop():
+            self._driver._loop.call_soon_threadsafe(self._driver._store_many, batch)
+        else:
+            self._driver._store_many(batch)
 
 class Driver(object):
-    def __init__(self, config, base_metadata):
+    def __init__(self, config, base_metadata, session=None, aggregator=None):
         # timeseries registered with this driver
         self.timeseries = {}
+        # path -> TimeseriesHandle of each timeseries
+        self._handles = {}
         self.instanceUUID = config.get('instance_uuid', uuid.uuid1())
         if not isinstance(self.instanceUUID, uuid.UUID):
             self.instanceUUID = uuid.UUID(self.instanceUUID)
         self.metadata = {}
-        self._report_destinations = config.get('report_destinations', ",").split(',')
+        self._destinations = [Destination.from_config(entry) for entry in config.get('report_destinations', "").split(',') if entry.strip()]
+        self._report_destinations = [destination.url for destination in self._destinations]
         # we introduce the archiver as a necessary part of driver configuration
         self._archiver = config.get('archiver', 'http://localhost:8079')
-        self._udp4socks = {}
+        # (protocol, host, port) -> transport or server of the push listeners
+        self._listeners = {}
+        # triggers reports ahead of the report interval, if configured. Created in prepare()
+        self._flush = None
+        # poll function name -> Ticker, with counts of ticks run and missed
+        self.tickers = {}
+        # fraction of the poll period the first poll is randomly brought forward by
+        self._poll_jitter = float(config.get('poll_jitter', 0))
+        # runs sync poll functions off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=int(config.get('poll_workers', 4)))
+        # thread running the event loop. Set in prepare()
+        self._loop_thread = None
+        # shared, connection-pooled HTTP session. Created in prepare() unless one is passed in,
+        # e.g. by a DriverHost sharing its session between instances; that one is not closed here
+        self._session = session
+        self._owns_session = session is None
+        # ReportAggregator merging this instance's reports with those of the other instances
+        # of a DriverHost, or None to send them separately
+        self._aggregator = aggregator
+        # republish subscriptions, pooled by query and, with merge_subscriptions set, merged
+        # into one stream demultiplexed through the uuids resolved at query_url
+        merge = str(config.get('merge_subscriptions', 'false')).lower() in ('1', 'true', 'yes', 'on')
+        self._subscriptions = SubscriptionManager(self._archiver+'/republish',
+                                                  config.get('query_url', self._archiver+'/api/query'), merge)
+        # optional file that readings spill into once spill_threshold readings are
+        # buffered in memory, e.g. during an archiver outage
+        self._spill = SpillFile(config['spill_file']) if config.get('spill_file') else None
+        self._spill_threshold = int(config.get('spill_threshold', 100000))
+        # max readings moved back from the spill file into memory per report
+        self._spill_chunk = int(config.get('spill_chunk', 10000))
         self._tasks = []
         self.config = config
 
@@ -150,29 +387,76 @@ class Driver(object):
 
     def prepare(self):
         self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        if self._session is None:
+            self._session = make_session(self.config, self._loop)
+        self._flush_event = asyncio.Event()
+        self._flush = FlushPolicy.from_config(self.config, self._loop, self._flush_event.set)
+        self._tasks.extend(self._subscriptions.start(self._session))
+        if self._aggregator is not None:
+            self._aggregator.join(self)
 
         if len(self._report_destinations) > 0:
             self._tasks.append(self._doreport())
             self._tasks.append(self._report())
 
+    def resync(self):
+        """
+        Makes the next report carry the full Properties/Metadata/Actuator blocks of every timeseries
+        """
+        for destination in self._destinations:
+            destination.resync()
+
     def add_subscription(self, query, callback, url=None, args=[]):
-        if url is None:
-            url = self._archiver+'/republish'
-        subscription = Subscriber(url, query, callback, args)
-        self._tasks.append(subscription.subscribe())
+        if self._off_loop():
+            return self.call_on_loop(self.add_subscription, query, callback, url, args)
+        self._subscriptions.add(query, callback, args, url)
+
+    def subscription_status(self):
+        """
+        Returns (query, connection state, reconnect count) for every republish stream
+        """
+        return self._subscriptions.status()
+
+    def actuation_status(self):
+        """
+        Returns {path: (writes, superseded messages, last write latency, max write latency)}
+        for every actuator
+        """
+        return {path: (ts.actuator.queue.writes, ts.actuator.queue.dropped, ts.actuator.queue.latency, ts.actuator.queue.max_latency)
+                for path, ts in self.timeseries.items() if ts.actuator is not None}
 
     def add_timeseries(self, path, unit_measure, unit_time, stream_type):
+        """
+        Registers a timeseries and returns its TimeseriesHandle, which also stands in for the path
+        """
+        if self._off_loop():
+            return self.call_on_loop(self.add_timeseries, path, unit_measure, unit_time, stream_type)
         # validate arguments
-        if path in self.timeseries.keys():
+        if path in self.timeseries:
             raise ValidationException("Path {0} is already registered as a timeseries ({1})".format(path, self.timeseries))
         else:
+            path = str(path)
             ts_uuid = str(uuid.uuid5(self.instanceUUID, path))
             self.timeseries[path] = Timeseries(path, ts_uuid, unit_measure, unit_time, stream_type)
+            self.timeseries[path].spill = self._spill
+            self._handles[path] = TimeseriesHandle(self, self.timeseries[path])
             # add default metadata. This can be replaced with attach_metadata
             self.attach_metadata(path, self._base_metadata)
-        return path
+        return self._handles[path]
+
+    def handle(self, path):
+        """
+        Returns the TimeseriesHandle of a registered path
+        """
+        handle = self._handles.get(path)
+        if handle is None:
+            raise TimeseriesException("Path {0} not registered with this driver ({1})".format(path, self.timeseries))
+        return handle
 
     def attach_metadata(self, path, metadata):
+        if self._off_loop():
+            return self.call_on_loop(self.attach_metadata, path, metadata)
         timeseries = self.timeseries.get(path, None)
         if timeseries is not None:
             timeseries.attach_metadata(metadata)
@@ -180,24 +464,24 @@ class Driver(object):
             self.metadata[path] = util.dict_merge(metadata, self.metadata[path])
 
     #TODO: right now this can only be done AFTER all the metadata changes. Make a timeseries reflect its metadata to its actuator automatically
-    def attach_actuator(self, path, callback, kind=None, states=None, range=None, args=[]):
+    def attach_actuator(self, path, callback, kind=None, states=None, range=None, args=[], min_interval=None):
+        """
+        Makes path actuatable: actuation messages for it are queued and written through
+        callback(message, *args) by an ActuationQueue, at least min_interval seconds apart
+        (default: the actuation_interval option, or 0)
+        """
+        if self._off_loop():
+            return self.call_on_loop(self.attach_actuator, path, callback, kind, states, range, args, min_interval)
         ts = self.timeseries.get(path, None)
-        ts.attach_actuator(kind, states, range)
         if ts is None:
-            raise ValidationException("Adding actuator to non-existant timeseries "+path)
-            return
-
-        # add in the actuator
-        if ts.has_actuator:
+            raise ValidationException("Adding actuator to non-existant timeseries {0}".format(path))
+        if ts.actuator is not None:
             raise ValidationException("Path {0} is already registered as an actuator".format(path))
-        else:
-            ts.actuator_model = kind
-            ts.actuator_states = states
-            ts.actuator_range = range
-            ts.actuator_callback = callback
-            ts.actuator_args = args
-            ts.has_actuator = True
-            self.add_subscription("Actuator/override = '{0}'".format(ts.actuator_uuid), callback, args=args)
+        actuator = ts.attach_actuator(kind, states, range, callback, args)
+        if min_interval is None:
+            min_interval = float(self.config.get('actuation_interval', 0))
+        actuator.queue = ActuationQueue(self._executor, callback, args, min_interval)
+        self.add_subscription("Actuator/override = '{0}'".format(actuator.uuid), actuator.queue.put)
 
     def attach_schedule(self, path, scheduleName, pointName):
         """
@@ -210,23 +494,125 @@ class Driver(object):
 
         We also start another subscription to ourselves so we know when our metadata has changed
         """
+        if self._off_loop():
+            return self.call_on_loop(self.attach_schedule, path, scheduleName, pointName)
         ts = self.timeseries.get(path, None)
-        if not ts.has_actuator: # ts does not have an actuator
+        if ts is None or ts.actuator is None: # ts does not have an actuator
             raise ValidationException("Path {0} cannot be scheduled because it is not an actuator or does not have an associated actuator".format(path))
-        self.add_subscription("Metadata/Schedule/Name = '{0}' and Metadata/Schedule/Point/Name = '{1}'".format(scheduleName, pointName), ts.actuator_callback, args=ts.actuator_args)
+        # scheduled values go through the same queue as overrides
+        self.add_subscription("Metadata/Schedule/Name = '{0}' and Metadata/Schedule/Point/Name = '{1}'".format(scheduleName, pointName), ts.actuator.queue.put)
 
         # add metadata for what schedule we subscribe to
         self.attach_metadata(path, {'Schedule': {'Subscribed': scheduleName,
                                                  'Point': {'Subscribed': pointName}}})
 
+    def _off_loop(self):
+        """
+        Whether the caller runs outside the event loop thread, e.g. in a sync poller
+        """
+        return self._loop_thread is not None and threading.get_ident() != self._loop_thread
+
+    def call_on_loop(self, func, *args):
+        """
+        Runs func(*args) on the event loop thread and returns its result once it has run. The
+        loop iterates over the timeseries and their metadata while reporting, so registering
+        or changing them from a sync poller is handed over to the loop instead
+        """
+        if not self._off_loop():
+            return func(*args)
+        future = Future()
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self._loop.call_soon_threadsafe(run)
+        return future.result()
+
     def add(self, path, value, time=None):
-        if path not in self.timeseries.keys():
+        ts = self.timeseries.get(path)
+        if ts is None:
             raise TimeseriesException("Path {0} not registered with this driver ({1})".format(path, self.timeseries))
-        self.timeseries[path].add(value, time)
+        self._add(ts, value, time)
+
+    def _add(self, ts, value, time):
+        ts._validate_value(value)
+        if time is None:
+            time = util.get_current_time_as(ts.unit_time)
+        if self._off_loop():
+            # buffers are only touched from the loop; hand the stamped reading over
+            self._loop.call_soon_threadsafe(self._store, ts, time, value)
+        else:
+            self._store(ts, time, value)
+
+    def _store(self, ts, time, value):
+        ts._store(time, value)
+        if self._flush is not None:
+            self._flush.added(1)
+
+    def add_many(self, readings, time=None):
+        """
+        Queues many readings in one call. readings is either an iterable of (path, value)
+        or (path, value, time) tuples, or a dict mapping each path to a column (list or
+        NumPy array) of values. Paths may be given as TimeseriesHandles or Timeseries, which
+        skips looking them up. Readings without their own time are stamped with time, or with a single clock
+        read shared by the whole batch
+        """
+        if isinstance(readings, dict):
+            columns, times = readings, {}
+        else:
+            columns, times = {}, {}
+            for reading in readings:
+                path = reading[0]
+                column = columns.get(path)
+                if column is None:
+                    column = columns[path] = []
+                if len(reading) > 2 and reading[2] is not None:
+                    times.setdefault(path, [None] * len(column)).append(reading[2])
+                elif path in times:
+                    times[path].append(None)
+                column.append(reading[1])
+
+        missing = [path for path in columns if not isinstance(path, (TimeseriesHandle, Timeseries)) and path not in self.timeseries]
+        if missing:
+            raise TimeseriesException("Paths {0} not registered with this driver ({1})".format(missing, self.timeseries))
+
+        now = datetime.now().timestamp()
+        stamps = {} # unit of time -> batch timestamp
+        batch = []
+        for path, values in columns.items():
+            if isinstance(path, TimeseriesHandle):
+                ts = path.timeseries
+            elif isinstance(path, Timeseries):
+                ts = path
+            else:
+                ts = self.timeseries[path]
+            stamp = time
+            if stamp is None:
+                stamp = stamps.get(ts.unit_time)
+                if stamp is None:
+                    stamp = stamps[ts.unit_time] = util.get_current_time_as(ts.unit_time, now)
+            ts_times = times.get(path)
+            if ts_times is not None:
+                stamp = [stamp if t is None else t for t in ts_times]
+            values = ts._validate_values(values)
+            batch.append((ts, ts._validate_times(stamp, len(values)), values))
+        if self._off_loop():
+            self._loop.call_soon_threadsafe(self._store_many, batch)
+        else:
+            self._store_many(batch)
+
+    def _store_many(self, batch):
+        count = 0
+        for ts, times, values in batch:
+            ts._store_many(times, values)
+            count += len(values)
+        if self._flush is not None:
+            self._flush.added(count)
 
     def _send(self, url, data, headers):
         try:
-            r = yield from aiohttp.request("POST", url, data=data, headers=headers)
+            r = yield from self._session.post(url, data=data, headers=headers)
             return r
         except Exception as e:
             print("error",url,e)
@@ -241,36 +627,193 @@ class Driver(object):
     @asyncio.coroutine
     def _startPoll(self, func, rate):
         """
-        Calls func every rate seconds
+        Calls func every rate seconds, on ticks aligned to the loop's monotonic clock
         """
+        name = getattr(func, '__qualname__', repr(func))
+        phase = jittered_phase(rate, self._poll_jitter, '{0}:{1}'.format(self.instanceUUID, name))
+        ticker = self.tickers[name] = Ticker(self._loop, rate, phase)
         while True:
-            yield from asyncio.sleep(rate)
-            func()
+            missed = ticker.missed
+            yield from ticker.wait()
+            if ticker.missed > missed:
+                logger.warning("Poll {0} overran its period, skipped {1} ticks".format(name, ticker.missed - missed))
+            yield from self._poll(func)
 
-    def listenUDP4(self, func, port, readsize=1024):
+    @asyncio.coroutine
+    def _poll(self, func):
+        """
+        Runs one poll. Coroutine pollers run on the event loop; plain functions run in the
+        driver's executor so that blocking device I/O does not stall reports and subscriptions
+        """
+        try:
+            if asyncio.iscoroutinefunction(func):
+                yield from func()
+            else:
+                yield from self._loop.run_in_executor(self._executor, func)
+        except Exception as e:
+            logger.exception("Poll {0} failed: {1}".format(func, e))
+
+    @asyncio.coroutine
+    def http_request(self, method, url, timeout=10, **kwargs):
+        """
+        Makes an HTTP request through the driver's pooled session without blocking the event
+        loop. kwargs go to aiohttp. Returns (status, body bytes)
+        """
+        response = yield from asyncio.wait_for(self._session.request(method, url, **kwargs), timeout)
+        try:
+            body = yield from asyncio.wait_for(response.read(), timeout)
+        finally:
+            yield from response.release()
+        return response.status, body
+
+    @asyncio.coroutine
+    def http_get(self, url, timeout=10, **kwargs):
+        return (yield from self.http_request('GET', url, timeout, **kwargs))
+
+    @asyncio.coroutine
+    def open_tcp(self, host, port, timeout=10):
+        """
+        Opens a TCP connection to a device. Returns asyncio (reader, writer) streams
+        """
+        return (yield from asyncio.wait_for(asyncio.open_connection(host, port), timeout))
+
+    @asyncio.coroutine
+    def tcp_request(self, host, port, payload, timeout=10):
+        """
+        Sends payload over a new TCP connection and returns everything the device sends back
+        until it closes the connection
+        """
+        reader, writer = yield from self.open_tcp(host, port, timeout)
+        try:
+            writer.write(payload)
+            return (yield from asyncio.wait_for(reader.read(), timeout))
+        finally:
+            writer.close()
+
+    def _listener_key(self, protocol, host, port):
         if not isinstance(port, int):
             raise ValidationException("Port {0} must be int".format(port))
-        if port in self._udp4sock:
-            raise SmapSocketException("Port {0} is already used for UDP4: {1}".format(port, self._udp4sock))
-        self._udp4sock[port] = socket.socket(AF_INET, SOCK_DGRAM)
-        self._udp4sock[port].bind(("0.0.0.0", int(port)))
-        self._tasks.append(self._listenUDP4(func, port, readsize))
+        key = (protocol, host, port)
+        if key in self._listeners:
+            raise SmapSocketException("Port {0} is already used for {1} on {2}".format(port, protocol, host))
+        self._listeners[key] = None
+        return key
+
+    def _dispatcher(self, func):
+        """
+        Returns the callable listeners hand their batches of (addr, data) packets to: recv_many,
+        or func(addr, data) for each packet if func is given
+        """
+        def dispatch(packets):
+            try:
+                if func is None:
+                    self.recv_many(packets)
+                else:
+                    for addr, data in packets:
+                        func(addr, data)
+            except Exception:
+                logger.exception("Handling {0} received packets failed".format(len(packets)))
+        return dispatch
+
+    def listenUDP(self, port, host='::', func=None, bufsize=65536, v6only=False):
+        """
+        Receives datagrams of up to bufsize bytes on port. The default host '::' listens on
+        IPv6 and, where the OS maps them and v6only is not set, IPv4 addresses as well;
+        '0.0.0.0' listens on IPv4 only. Datagrams are handed over in batches to recv_many, or
+        to func(addr, data) if given. The port is bound right away, so a port that is taken
+        raises SmapSocketException here
+        """
+        key = self._listener_key('udp', host, port)
+        try:
+            sock = DatagramListener.open_socket(host, port, v6only)
+        except OSError as e:
+            del self._listeners[key]
+            raise SmapSocketException("Could not listen on UDP {0} port {1}: {2}".format(host, port, e))
+        # read once the loop runs; close() closes the bare socket until then
+        self._listeners[key] = sock
+        self._tasks.append(self._listenUDP(key, sock, func, bufsize))
 
     @asyncio.coroutine
-    def _listenUDP4(self, func, port, readsize):
-        while True:
-            data = yield from self._udp4sock[port].read(readsize)
-            func(data.decode())
+    def _listenUDP(self, key, sock, func, bufsize):
+        protocol, host, port = key
+        self._listeners[key] = DatagramListener(self._loop, sock, self._dispatcher(func), bufsize=bufsize)
+        logger.info("Listening on UDP {0} port {1}".format(host, port))
+
+    def listenUDP4(self, func, port, readsize=1024):
+        """
+        Calls func with every datagram of up to readsize bytes received on port over IPv4,
+        decoded to a string
+        """
+        self.listenUDP(port, '0.0.0.0', lambda addr, data: func(data.decode()), readsize)
+
+    def listenUDP6(self, port, func=None):
+        """
+        Receives datagrams on port over IPv6 only
+        """
+        self.listenUDP(port, '::', func, v6only=True)
+
+    def listenTCP(self, port, host=None, func=None, bufsize=65536):
+        """
+        Accepts TCP connections on port, on all IPv4 and IPv6 addresses by default. Each
+        connection is received into a preallocated buffer of bufsize bytes and what arrives is
+        handed over in batches to recv_many, or to func(addr, data) if given. The port is bound
+        right away, so a port that is taken raises SmapSocketException here
+        """
+        key = self._listener_key('tcp', host, port)
+        try:
+            sock = StreamListener.open_socket(host, port)
+        except OSError as e:
+            del self._listeners[key]
+            raise SmapSocketException("Could not listen on TCP {0} port {1}: {2}".format(host or '*', port, e))
+        # accepted from once the loop runs; close() closes the bare socket until then
+        self._listeners[key] = sock
+        self._tasks.append(self._listenTCP(key, sock, func, bufsize))
+
+    @asyncio.coroutine
+    def _listenTCP(self, key, sock, func, bufsize):
+        protocol, host, port = key
+        dispatch = self._dispatcher(func)
+        self._listeners[key] = yield from self._loop.create_server(
+            lambda: StreamListener(self._loop, dispatch, bufsize), sock=sock)
+        logger.info("Listening on TCP {0} port {1}".format(host or '*', port))
+
+    @property
+    def session(self):
+        """
+        The driver's aiohttp ClientSession, for device drivers doing their own HTTP I/O
+        """
+        return self._session
 
     def _dostart(self):
         """
         Starts the event loop with the registered tasks
         """
-        self._loop.run_until_complete(
-            asyncio.wait(
-                self._tasks
+        try:
+            self._loop.run_until_complete(
+                asyncio.wait(
+                    self._tasks
+                )
             )
-        )
+        finally:
+            self._loop.run_until_complete(self.close())
+
+    @asyncio.coroutine
+    def close(self):
+        """
+        Releases the driver's listeners, pooled connections, spill file and poll executor
+        """
+        for listener in self._listeners.values():
+            if listener is not None:
+                listener.close()
+        self._listeners.clear()
+        if self._aggregator is not None:
+            self._aggregator.leave(self)
+        if self._session is not None and self._owns_session:
+            yield from self._session.close()
+            self._session = None
+        if self._spill is not None:
+            self._spill.close()
+        self._executor.shutdown(wait=False)
 
     @classmethod
     def run(klass, config, opts, metadata):
@@ -284,42 +827,146 @@ class Driver(object):
     @asyncio.coroutine
     def _report(self):
         while True:
-            yield from asyncio.sleep(self.rate)
+            # wakes up early if the flush policy triggers a report
+            try:
+                yield from asyncio.wait_for(self._flush_event.wait(), self.rate)
+            except asyncio.TimeoutError:
+                pass
             yield from self._doreport()
 
+    def _checkspill(self):
+        """
+        Starts spilling new readings to disk once spill_threshold readings are buffered in
+        memory. While there is room in memory, moves the oldest spilled readings back in
+        bounded chunks, and stops spilling once the file is drained
+        """
+        buffered = sum(len(ts.buffer) for ts in self.timeseries.values())
+        if not self._spill.active:
+            if buffered >= self._spill_threshold:
+                logger.warning("{0} readings buffered, spilling to {1}".format(buffered, self._spill.path))
+                self._spill.active = True
+            return
+        if buffered < self._spill_threshold:
+            limit = min(self._spill_chunk, self._spill_threshold - buffered)
+            byuuid = {ts.uuid: ts for ts in self.timeseries.values()}
+            for ts, time, value in self._spill.read(limit, byuuid):
+                ts.buffer.append(time, value)
+            if len(self._spill) == 0:
+                logger.info("Drained {0}".format(self._spill.path))
+                self._spill.active = False
+
     @asyncio.coroutine
     def _doreport(self):
             try:
-                # generate report
-                report = {path: ts.get_report() for path, ts in self.timeseries.items()}
-                if not len(report) > 0:
-                    return # nothing to send
+                if self._spill is not None:
+                    self._checkspill()
 
                 table = []
-                for path, ts in report.items():
-                    if len(ts['Readings']) == 0: continue
-                    values = [x[1] for x in ts['Readings']]
-                    times = [x[0] for x in ts['Readings']]
-                    table.append([path, len(ts['Readings']), min(values), max(values)])
-                logger.info(tabulate(table))
-
-                payload = json.dumps(report)
-                headers = {'Content-type': 'application/json'}
-                coros = [] # list of requests to send out
-                logger.info("Sending reports to {0}...".format(self._report_destinations))
-                for location in self._report_destinations:
-                    coros.append(asyncio.Task(self._send(location, payload, headers)))
-                responses = yield from asyncio.gather(*coros)
-                for response in responses:
-                    if response.status == 200:
-                        logger.info("Report OK")
-                        for ts in self.timeseries.values():
-                            ts.clear_report()
+                for path, ts in self.timeseries.items():
+                    if len(ts.buffer) == 0: continue
+                    if ts.stream_type == STREAM_TYPE_NUMERIC:
+                        table.append([path, len(ts.buffer), min(ts.buffer.values), max(ts.buffer.values)])
                     else:
-                        logger.warning("Report failed!", response.content)
-                    response.close()
+                        table.append([path, len(ts.buffer), '', ''])
+                if table:
+                    logger.info(tabulate(table))
+
+                self._flush_event.clear()
+
+                # each destination gets whatever it has not acknowledged yet. A destination
+                # still busy with earlier reports is skipped until those complete
+                sent = False
+                for destination in self._destinations:
+                    if self._aggregator is not None:
+                        self._aggregator.request(destination.url)
+                        sent = True
+                        continue
+                    if destination.busy:
+                        continue
+                    destination.busy = True
+                    sent = True
+                    self._loop.create_task(self._deliver(destination))
+                # if every destination was busy, the flush policy stays due and _deliver
+                # triggers the report once one is done
+                if sent and self._flush is not None:
+                    self._flush.reset()
             except Exception as e:
                 print("error", e)
 
+    def _prepare(self, destination):
+        """
+        Returns the next report for the destination and its payload, within the size limits
+        of the flush policy and compressed as configured for the destination. Returns
+        (None, None) if there is nothing to send
+        """
+        max_readings = self._flush.max_readings if self._flush is not None else 0
+        max_bytes = self._flush.max_bytes if self._flush is not None else 0
+        report = destination.prepare(self.timeseries, max_readings)
+        if report is None:
+            return None, None
+        payload = serializer.dumps(report.report)
+        while max_bytes and len(payload) > max_bytes and len(report) > 1:
+            report = destination.prepare(self.timeseries, len(report) // 2)
+            payload = serializer.dumps(report.report)
+        return report, outbound.encode(payload, destination.encoding)
+
+    @asyncio.coroutine
+    def _deliver(self, destination):
+        """
+        Sends the destination the readings it has not acknowledged yet. Each acknowledged report
+        drops the readings that every destination has received. If the reports are bounded by
+        the flush policy, chunks go out one after another until the backlog is sent
+        """
+        try:
+            while True:
+                report, payload = self._prepare(destination)
+                if report is None:
+                    return
+                headers = {'Content-type': 'application/json'}
+                if destination.encoding is not None:
+                    headers['Content-Encoding'] = destination.encoding
+                logger.info("Sending report {0} to {1}...".format(report.seq, destination.url))
+                response = yield from self._send(destination.url, payload, headers)
+                if response is None:
+                    return
+                if response.status in (400, 415) and destination.encoding is not None:
+                    # the destination does not take compressed reports; resend uncompressed
+                    logger.warning("{0} rejected {1} report: {2}. Sending uncompressed".format(destination.url, destination.encoding, response.status))
+                    destination.encoding = None
+                    yield from response.release()
+                    continue
+                ok = response.status == 200
+                if ok:
+                    logger.info("Report {0} to {1} OK".format(report.seq, destination.url))
+                    destination.acknowledge(report)
+                    self._trim()
+                else:
+                    logger.warning("Report {0} to {1} failed: {2}".format(report.seq, destination.url, response.status))
+                yield from response.release()
+                if not ok or not report.partial:
+                    return
+        except Exception as e:
+            print("error", e)
+        finally:
+            destination.busy = False
+            if self._flush is not None and self._flush.due():
+                self._flush_event.set()
+
+    def _trim(self):
+        """
+        Drops buffered readings acknowledged by all destinations
+        """
+        for path, ts in self.timeseries.items():
+            ts.buffer.trim(min(destination.cursor(path, ts) for destination in self._destinations))
+
     def recv(self, addr, data):
         pass
+
+    def recv_many(self, packets):
+        """
+        Called with the (addr, data) packets a listener received in one batch. Calls recv for
+        each by default; push-based drivers expecting high packet rates can override this to
+        decode the batch at once and store it through add_many
+        """
+        for addr, data in packets:
+            self.recv(addr, data)
@@ -1,7 +1,7 @@
 from XBOSDriver import driver
+from XBOSDriver.pointmap import PointMap
+import asyncio
 import json
-from requests.exceptions import ConnectionError
-import requests
 
 config = {
 	"report_destinations": ["http://localhost:8079/add/apikey"],
@@ -20,6 +20,23 @@ opts = {
 	"deviceID": "801788ac-df67-11e5-941b-5cc5d4ded1ae"
 }
 
+# the thermostat reports a temp of -1 when it has no reading
+POINTS = [
+	{"name": "temp", "key": "temp", "unit": "F", "range": lambda temp: temp != -1},
+	{"name": "hvac_mode", "key": "tmode", "unit": "Mode"},
+	{"name": "hvac_state", "key": "tstate", "unit": "State"},
+	{"name": "fan_mode", "key": "fmode", "unit": "Mode"},
+	{"name": "fan_state", "key": "fstate", "unit": "State"},
+	{"name": "override", "key": "override", "unit": "Mode"},
+	{"name": "hold", "key": "hold", "unit": "Mode"},
+	{"name": "program_mode", "key": "program_mode", "unit": "Mode"},
+]
+
+SETPOINTS = [
+	{"name": "temp_heat", "key": "t_heat", "unit": "F"},
+	{"name": "temp_cool", "key": "t_cool", "unit": "F"},
+]
+
 class CT80Driver(driver.Driver):
 	def setup(self, opts):
 		self.rate = int(opts.get('report_rate', 10))
@@ -29,21 +46,10 @@ class CT80Driver(driver.Driver):
 
 		self._setpoints = {'t_heat': 60,
 						   't_cool': 80}
-		# list of API points
-		self.points = [
-						{"smapname": "temp", "name": "temp", "unit": "F"},
-						{"smapname": "hvac_mode", "name": "tmode", "unit": "Mode"},
-						{"smapname": "hvac_state", "name": "tstate", "unit": "State"},
-						{"smapname": "fan_mode", "name": "fmode", "unit": "Mode"},
-						{"smapname": "fan_state", "name": "fstate", "unit": "State"},
-						{"smapname": "override", "name": "override", "unit": "Mode"},
-						{"smapname": "hold", "name": "hold", "unit": "Mode"},
-						{"smapname": "temp_heat", "name": "t_heat", "unit": "F"},
-						{"smapname": "temp_cool", "name": "t_cool", "unit": "F"},
-						{"smapname": "program_mode", "name": "program_mode", "unit": "Mode"}
-					  ]
-		for p in self.points:
-			tspath = self.add_timeseries('/'+p['smapname'], p['unit'], 'milliseconds', 'numeric')
+		# points of the /tstat API; .ini point.<name> options add to or replace them. The
+		# setpoints are published separately, depending on whether the driver holds them
+		self.points = PointMap.from_config(opts, POINTS, strict=True).compile(self)
+		self.setpoints = PointMap.from_config({}, SETPOINTS).compile(self)
 		self.add_timeseries('/humidity', '%RH', 'milliseconds','numeric')
 
 		metadata_type = [
@@ -84,24 +90,20 @@ class CT80Driver(driver.Driver):
 	def start(self):
 		self.startPoll(self.poll, self.poll_rate)
 
+	@asyncio.coroutine
 	def poll(self):
 		try:
-			r = requests.get(self.url)
-		except ConnectionError as e:
+			status, body = yield from self.http_get(self.url)
+		except Exception as e:
 			print('error connecting',e)
 			return
-		if not r.ok:
-			print('got status code',r.status_code,'from api')
+		if status != 200:
+			print('got status code',status,'from api')
+			return
+		vals = json.loads(body.decode('utf-8'))
+		# sometimes the ct80 hiccups and doesn't give data OR the mode limits what we see
+		if not self.points.update(vals):
 			return
-		vals = json.loads(r.text)
-		for p in self.points:
-			if p['name'] not in vals or p['name'] in ['t_heat','t_cool']: # sometimes the ct80 hiccups and doesn't give data OR the mode limits what we see
-				continue
-			if type(vals[p['name']]) not in [int, float]:
-				return
-			if p['name'] == 'temp' and vals[p['name']] == -1:
-				return
-			self.add('/' + p["smapname"], float(vals[p["name"]]))
 
 		# check which setpoint to write: if current temp is closer to heating setpoing,
 		# set t_heat, else set t_cool
@@ -110,30 +112,29 @@ class CT80Driver(driver.Driver):
 			self.add('/temp_cool', float(self._setpoints['t_cool']))
 			if abs(self._setpoints['t_heat'] - vals['temp']) < abs(self._setpoints['t_cool'] - vals['temp']):
 				print('Writing temp_heat', self._setpoints['t_heat'])
-				self.write_setting('t_heat', self._setpoints['t_heat'])
+				yield from self.write_setting('t_heat', self._setpoints['t_heat'])
 			else:
 				print('Writing temp_cool', self._setpoints['t_cool'])
-				self.write_setting('t_cool', self._setpoints['t_cool'])
+				yield from self.write_setting('t_cool', self._setpoints['t_cool'])
 		else: # publish the current t_heat, t_cool of the thermostat
-			if 't_heat' in vals:
-				self.add('/temp_heat', float(vals['t_heat']))
-			if 't_cool' in vals:
-				self.add('/temp_cool', float(vals['t_cool']))
-		r = requests.get(self.url + '/humidity')
-		val = json.loads(r.text)
+			self.setpoints.update(vals)
+		status, body = yield from self.http_get(self.url + '/humidity')
+		val = json.loads(body.decode('utf-8'))
 		self.add('/humidity', float(val['humidity']))
 
+	@asyncio.coroutine
 	def write_setting(self, pointname, setting):
 		print('actuating', pointname)
 		payload = {pointname: setting}
-		r = requests.post(self.url, data=json.dumps(payload))
-		print(r)
+		status, body = yield from self.http_request('POST', self.url, data=json.dumps(payload))
+		print(status)
 
+	@asyncio.coroutine
 	def recv_actuation(self, data, *args):
 		pointname = args[0]
 		if 'Readings' not in data: return
 		setting = data['Readings'][-1][1]
-		self.write_setting(pointname, setting)
+		yield from self.write_setting(pointname, setting)
 		#if not request and self.name in ['t_heat','t_cool']:
 		#	 self.driver._setpoints[self.name] = state
 		#	 return
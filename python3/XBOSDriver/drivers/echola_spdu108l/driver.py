@@ -1,9 +1,7 @@
 from XBOSDriver import driver
-import requests
-from requests.auth import HTTPDigestAuth
-from requests.exceptions import ConnectionError
+from XBOSDriver.util import XMLIngest
+import asyncio
 import json
-import xmltodict
 import time
 
 config = {
@@ -32,12 +30,16 @@ class EcholaSPDU108LDriver(driver.Driver):
         self.readURL = 'http://' + self.ip + '/api.xml'
         self.actURL = 'http://' + self.ip + '/switch.cgi?out'
 
+        # api.xml holds the state and power of each plug in <pstateN> and <powN>
+        self.ingest = XMLIngest()
         for plug in range(1,9):
             onpath = self.add_timeseries("/echola/plug/{0}/on".format(plug), "On/Off", "milliseconds", "numeric")
             self.attach_metadata(onpath, {"Point": {"Type": "Reading", "Reading": "On/Off"}})
+            self.ingest.bind('response/pstate{0}'.format(plug), onpath, int)
 
             powerpath = self.add_timeseries("/echola/plug/{0}/power".format(plug), "Watts", "milliseconds", "numeric")
             self.attach_metadata(powerpath, {"Point": {"Type": "Sensor", "Sensor": "Power"}})
+            self.ingest.bind('response/pow{0}'.format(plug), powerpath, float)
 
         for path, timeseries in self.timeseries.items():
             self.attach_metadata(path, {'Device': {
@@ -54,12 +56,10 @@ class EcholaSPDU108LDriver(driver.Driver):
     def start(self):
         self.startPoll(self.poll, self.rate)
 
+    @asyncio.coroutine
     def poll(self):
-        r = requests.get(self.readURL)
-        data_dict = xmltodict.parse(r.content).get('response')
-        for plug in range(1,9):
-            self.add('/echola/plug/{0}/on'.format(plug), int(data_dict['pstate{0}'.format(plug)]))
-            self.add('/echola/plug/{0}/power'.format(plug), float(data_dict['pow{0}'.format(plug)]))
+        status, body = yield from self.http_get(self.readURL)
+        self.add_many(self.ingest.parse(body))
     
     def actuate_plug(self, data, *args):
         plugnum = args[0]
@@ -1,9 +1,8 @@
 from XBOSDriver import driver
-import requests
-from requests.auth import HTTPDigestAuth
-from requests.exceptions import ConnectionError
-import json
-import time
+from XBOSDriver.digest import DigestAuthClient
+from XBOSDriver.pointmap import PointMap
+from urllib.parse import parse_qsl
+import asyncio
 
 config = {
     "report_destinations": ["http://localhost:8079/add/apikey"],
@@ -23,6 +22,21 @@ opts = {
     "deviceID": "96f75948-d068-11e5-bef6-0cc47a0f7eea"
 }
 
+# the thermostat's OIDs, as returned by /get (OID4.1.13=720&OID4.1.14=40)
+POINTS = [
+    {"name": "temp", "key": "OID4.1.13", "unit": "F", "scale": 0.1}, # thermAverageTemp
+    {"name": "humidity", "key": "OID4.1.14", "unit": "%RH"}, # thermRelativeHumidity
+    {"name": "hvac_state", "key": "OID4.1.2", "unit": "Mode", "parse": int,
+     "map": {1:0, 2:0, 3:1, 4:1, 5:1, 6:2, 7:2, 8:0, 9:0}}, # thermHvacState
+    {"name": "fan_state", "key": "OID4.1.4", "unit": "Mode", "parse": int, "map": {0:0, 1:0, 2:1}}, # thermFanState
+    {"name": "temp_heat", "key": "OID4.1.5", "unit": "F", "scale": 0.1}, # thermSetbackHeat
+    {"name": "temp_cool", "key": "OID4.1.6", "unit": "F", "scale": 0.1}, # thermSetbackCool
+    {"name": "hold", "key": "OID4.1.9", "unit": "Mode", "parse": int, "map": {1:0, 2:1, 3:0}}, # hold/override
+    {"name": "override", "key": "OID4.1.9", "unit": "Mode", "parse": int, "map": {1:0, 3:1, 2:0}}, # hold/override
+    {"name": "hvac_mode", "key": "OID4.1.1", "unit": "Mode", "parse": int, "offset": -1}, # thermHvacMode
+    {"name": "fan_mode", "key": "OID4.1.3", "unit": "Mode", "parse": int}, # thermFanMode
+]
+
 class IMT550CDriver(driver.Driver):
     def setup(self, opts):
         self.rate = int(opts.get('report_rate', 10))
@@ -30,63 +44,14 @@ class IMT550CDriver(driver.Driver):
         self.ip = opts.get('ip')
         self.user = opts.get('user', None)
         self.password = opts.get('password', None)
-        self.points0 = [
-                          {"name": "temp", "unit": "F", "data_type": "double",
-                            "OID": "4.1.13", "range": (-30.0,200.0),
-                            "access": 4, "devtosmap": lambda x: x/10,
-                            "smaptodev": lambda x: x*10,
-                            "act_type": None}, # thermAverageTemp
-                          {"name": "humidity", "unit": "%RH",
-                           "data_type": "double", "OID": "4.1.14",
-                            "range": (0,95), "access": 0,
-                            "devtosmap": lambda x: x, "smaptodev": lambda x: x,
-                            "act_type": "continuous"}, #thermRelativeHumidity
-                          {"name": "hvac_state", "unit": "Mode",
-                            "data_type": "long",
-                            "OID": "4.1.2", "range": [0,1,2], "access": 4,
-                            "devtosmap":  lambda x: {1:0, 2:0, 3:1, 4:1, 5:1, 6:2, 7:2, 8:0, 9:0}[x],
-                            "smaptodev":  lambda x: {x:x}[x],
-                            "act_type": "discrete"}, # thermHvacState
-                          {"name": "fan_state", "unit": "Mode", "data_type": "long",
-                            "OID": "4.1.4", "range": [0,1], "access": 4,
-                            "devtosmap":  lambda x: {0:0, 1:0, 2:1}[x],
-                            "smaptodev": lambda x: x,
-                            "act_type": "binary"}, # thermFanState
-                          {"name": "temp_heat", "unit": "F", "data_type": "double",
-                            "OID": "4.1.5", "range": (45.0,95.0), "access": 6,
-                            "devtosmap": lambda x: x/10, "smaptodev": lambda x: x*10,
-                            "act_type": "continuous"}, #thermSetbackHeat
-                          {"name": "temp_cool", "unit": "F", "data_type": "double",
-                            "OID": "4.1.6",
-                            "range": (45.0,95.0), "access": 6,
-                            "devtosmap": lambda x: x/10, "smaptodev": lambda x: x*10,
-                            "act_type": "continuous"}, #thermSetbackCool
-                          {"name": "hold", "unit": "Mode",
-                            "data_type": "long", "OID": "4.1.9",
-                            "range": [0,1], "access": 6,
-                            "devtosmap": lambda x: {1:0, 2:1, 3:0}[x],
-                            "smaptodev": lambda x: {0:1, 1:2}[x],
-                            "act_type": "binary"}, # hold/override
-                          {"name": "override", "unit": "Mode",
-                            "data_type": "long", "OID": "4.1.9",
-                            "range": [0,1], "access": 6,
-                            "devtosmap": lambda x: {1:0, 3:1, 2:0}[x],
-                            "smaptodev": lambda x: {0:1, 1:3}[x],
-                            "act_type": "binary"}, # hold/override
-                          {"name": "hvac_mode", "unit": "Mode", "data_type": "long",
-                            "OID": "4.1.1", "range": [0,1,2,3],
-                            "access": 6,
-                            "devtosmap": lambda x: x-1,
-                            "smaptodev": lambda x: x+1,
-                            "act_type": "discrete"}, # thermHvacMode
-                          {"name": "fan_mode", "unit": "Mode", "data_type": "long",
-                            "OID": "4.1.3", "range": [1,2,3], "access": 6,
-                            "devtosmap": lambda x: x, "smaptodev": lambda x: x,
-                            "act_type": "discrete"} # thermFanMode
-                       ]
-        ts = {}
-        for p in self.points0:
-            ts[p['name']] = self.add_timeseries('/' + p["name"], p["unit"], 'milliseconds', 'numeric')
+        # max requests in flight to the thermostat at once
+        self.concurrency = int(opts.get('concurrency', 4))
+        # OIDs read per /get request; the thermostat answers several at once
+        self.batch_size = int(opts.get('batch_size', 10))
+        # points read from the thermostat; .ini point.<name> options add to or replace them
+        self.points = PointMap.from_config(opts, POINTS).compile(self)
+        # hold and override share an OID, so it is only read once
+        self.oids = self.points.keys()
 
         # setup metadata for each timeseries
         metadata_type = [
@@ -133,49 +98,53 @@ class IMT550CDriver(driver.Driver):
         self.attach_schedule('/temp_heat', 'weekday', 'Heating Setpoint')
         self.attach_schedule('/temp_cool', 'weekday', 'Cooling Setpoint')
 
+    @asyncio.coroutine
     def set_heating_setpoint(self, data, *args):
         print("GOT DATA", data, args)
         if 'Readings' not in data: return
         setting = data['Readings'][-1][1]
         print("got data HEAT", data, setting)
-        payload = {"OID4.1.5": int(setting*10), "submit": "Submit"}
-        r = requests.get('http://'+self.ip+"/pdp/",
-            auth=HTTPDigestAuth(self.user, self.password), params=payload)
-        print(r)
+        yield from self.write_oid('4.1.5', int(round(self.points['temp_heat'].to_device(setting))))
 
+    @asyncio.coroutine
     def set_cooling_setpoint(self, data, *args):
         print("GOT DATA", data, args)
         if 'Readings' not in data: return
         setting = data['Readings'][-1][1]
         print("got data COOL", data, setting)
-        payload = {"OID4.1.6": int(setting*10), "submit": "Submit"}
-        r = requests.get('http://'+self.ip+"/pdp/",
-            auth=HTTPDigestAuth(self.user, self.password), params=payload)
-        print(r)
+        yield from self.write_oid('4.1.6', int(round(self.points['temp_cool'].to_device(setting))))
+
+    @asyncio.coroutine
+    def write_oid(self, oid, value):
+        url = 'http://{0}/pdp/?OID{1}={2}&submit=Submit'.format(self.ip, oid, value)
+        status, body = yield from self.client.get(url)
+        print(status)
 
     def start(self):
+        self.client = DigestAuthClient(self.session, self.user, self.password, self.concurrency)
         self.startPoll(self.poll, self.poll_rate)
 
+    @asyncio.coroutine
     def poll(self):
-        for p in self.points0:
-            url = 'http://%s/get?OID%s' % (self.ip, p["OID"])
-            try:
-                r = requests.get(url, auth=HTTPDigestAuth(self.user, self.password))
-                if not r.ok:
-                    print('got status code',r.status_code,'from api')
-                    time.sleep(5)
-                    return
-                val = r.text.split('=', 1)[-1]
-                # when the thermostat reboots, sometimes we get extraneous readings
-                if abs(int(val)) > 20000:
-                    time.sleep(5)
-                    return
-                print(p["name"],val)
-                self.add("/" + p["name"], p['devtosmap'](float(val)))
-            except Exception as e:
-                print('error connecting',e)
-                time.sleep(5)
+        # read the OIDs in batches of batch_size, all batches concurrently
+        batches = [self.oids[i:i+self.batch_size] for i in range(0, len(self.oids), self.batch_size)]
+        urls = ['http://{0}/get?{1}'.format(self.ip, '&'.join(oid + '=' for oid in batch)) for batch in batches]
+        try:
+            responses = yield from asyncio.gather(*[self.client.get(url) for url in urls])
+        except Exception as e:
+            print('error connecting',e)
+            return
+        vals = {}
+        for status, body in responses:
+            if status != 200:
+                print('got status code',status,'from api')
                 return
+            # OID4.1.13=720&OID4.1.14=40
+            vals.update(parse_qsl(body.decode('utf-8').strip()))
+        # when the thermostat reboots, sometimes we get extraneous readings
+        if any(abs(int(val)) > 20000 for val in vals.values()):
+            return
+        self.points.update(vals)
 
 def run(dvr, config, opts):
     inst = dvr(config)
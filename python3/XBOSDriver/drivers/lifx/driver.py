@@ -33,6 +33,8 @@ class LIFXDriver(driver.Driver):
         # assign numbers
         self.lightlabels = {idx: l for idx, l in enumerate(self.lights.values())}
 
+        # idx -> handles of the on, hue and brightness timeseries of the light
+        self.handles = {}
         for idx, light in self.lightlabels.items():
             onpath = self.add_timeseries('/light{0}/on'.format(idx), 'On/Off', 'milliseconds', 'numeric')
             self.attach_metadata(onpath, {'Point': {'Type': 'Command', 'Command': 'On'}})
@@ -42,6 +44,7 @@ class LIFXDriver(driver.Driver):
 
             bripath = self.add_timeseries('/light{0}/brightness'.format(idx), 'Brightness', 'milliseconds', 'numeric')
             self.attach_metadata(bripath, {'Point': {'Type': 'Command', 'Command': 'Brightness'}})
+            self.handles[idx] = (onpath, huepath, bripath)
 
         for path, timeseries in self.timeseries.items():
             self.attach_metadata(path, {'Location': {'Building': "Soda Hall",
@@ -68,9 +71,10 @@ class LIFXDriver(driver.Driver):
     def poll(self):
         for idx, light in self.lightlabels.items():
             light.get_state()
-            self.add('/light{0}/on'.format(idx), int(light.power))
-            self.add('/light{0}/hue'.format(idx), int(light.hue))
-            self.add('/light{0}/brightness'.format(idx), int(light.brightness))
+            on, hue, brightness = self.handles[idx]
+            on.add(int(light.power))
+            hue.add(int(light.hue))
+            brightness.add(int(light.brightness))
 
     def turnon(self, data):
         print("actuating on", data)
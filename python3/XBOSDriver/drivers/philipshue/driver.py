@@ -23,22 +23,13 @@ class PhilipsHueDriver(driver.Driver):
         self.bridge = phue.Bridge(opts.get('bridge_ip'))
         self.bridge.connect()
 
-        self.registered_lights = set()
+        # light id -> handles of the on, hue and brightness timeseries of the light
+        self.registered_lights = {}
 
         # load the lights
         for light_id, light_status in self.bridge.get_api()['lights'].items():
             if light_status['state']['reachable']:
-                # add timeseries for on/off, hue, brightness
-                onpath = self.add_timeseries('/light{0}/on'.format(light_id), 'On/Off', 'milliseconds', 'numeric')
-                self.attach_metadata(onpath, {'Point': {'Type': 'State', 'State': 'On/Off'}})
-
-                huepath = self.add_timeseries('/light{0}/hue'.format(light_id), 'Hue', 'milliseconds', 'numeric')
-                self.attach_metadata(huepath, {'Point': {'Type': 'State', 'State': 'Hue'}})
-
-                bripath = self.add_timeseries('/light{0}/brightness'.format(light_id), 'Brightness', 'milliseconds', 'numeric')
-                self.attach_metadata(bripath, {'Point': {'Type': 'State', 'State': 'Brightness'}})
-
-                self.registered_lights.add(light_id)
+                self.register_light(light_id)
 
         # TODO: have a library of metadata configurations for common things, e.g. light brightness, etc
 
@@ -59,20 +50,38 @@ class PhilipsHueDriver(driver.Driver):
                                         })
 
 
+    def register_light(self, light_id):
+        """
+        Adds the on/off, hue and brightness timeseries of a light and returns their handles
+        """
+        onpath = self.add_timeseries('/light{0}/on'.format(light_id), 'On/Off', 'milliseconds', 'numeric')
+        self.attach_metadata(onpath, {'Point': {'Type': 'State', 'State': 'On/Off'}})
+
+        huepath = self.add_timeseries('/light{0}/hue'.format(light_id), 'Hue', 'milliseconds', 'numeric')
+        self.attach_metadata(huepath, {'Point': {'Type': 'State', 'State': 'Hue'}})
+
+        bripath = self.add_timeseries('/light{0}/brightness'.format(light_id), 'Brightness', 'milliseconds', 'numeric')
+        self.attach_metadata(bripath, {'Point': {'Type': 'State', 'State': 'Brightness'}})
+
+        self.registered_lights[light_id] = (onpath, huepath, bripath)
+        return self.registered_lights[light_id]
+
     def start(self):
         self.startPoll(self.poll, self.rate)
 
     def poll(self):
+        readings = []
         for light_id, light_status in self.bridge.get_api()['lights'].items():
             if light_status['state']['reachable']:
-                if light_id not in self.registered_lights:
-                    self.add_timeseries('/light{0}/on'.format(light_id), 'On/Off', 'seconds', 'numeric')
-                    self.add_timeseries('/light{0}/hue'.format(light_id), 'Hue', 'seconds', 'numeric')
-                    self.add_timeseries('/light{0}/brightness'.format(light_id), 'Brightness', 'seconds', 'numeric')
-                    self.registered_lights.add(light_id)
-                self.add('/light{0}/on'.format(light_id), int(light_status['state']['on']))
-                self.add('/light{0}/hue'.format(light_id), int(light_status['state']['hue']))
-                self.add('/light{0}/brightness'.format(light_id), int(light_status['state']['bri']))
+                handles = self.registered_lights.get(light_id)
+                if handles is None:
+                    # poll runs off the event loop; register the new light on it
+                    handles = self.call_on_loop(self.register_light, light_id)
+                on, hue, brightness = handles
+                readings.append((on, int(light_status['state']['on'])))
+                readings.append((hue, int(light_status['state']['hue'])))
+                readings.append((brightness, int(light_status['state']['bri'])))
+        self.add_many(readings)
 
 
 def run(dvr, config, opts):
@@ -1,8 +1,98 @@
 from XBOSDriver import driver
+from XBOSDriver.util import XMLIngest
 import xml.etree.ElementTree as ET
-import socket
-import sys
-import time
+import asyncio
+
+class EagleClient(object):
+	"""
+	Client for the local API of a Rainforest Eagle on TCP port 5002. The connection is kept
+	and reused for the next command as long as the Eagle leaves it open; if the Eagle closes
+	it after a response, the next command reconnects. A response is a series of XML elements
+	without a common root. They are parsed as they arrive through an XMLIngest, and the response
+	is complete when the Eagle closes the connection or, on a kept connection, once the
+	element a command expects last has arrived, or complete elements and then nothing for
+	idle seconds
+	"""
+	def __init__(self, host, port=5002, timeout=5, idle=0.25, connect_delay=1):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.idle = idle
+		# pause between connecting and sending a command, for firmwares that need one
+		self.connect_delay = connect_delay
+		# whether the Eagle keeps connections open between commands; None until known
+		self.persistent = None
+		self.connects = 0
+		self._reader = None
+		self._writer = None
+
+	@asyncio.coroutine
+	def _connect(self):
+		self._reader, self._writer = yield from asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+		self.connects += 1
+		if self.connect_delay:
+			yield from asyncio.sleep(self.connect_delay)
+
+	def close(self):
+		if self._writer is not None:
+			self._writer.close()
+		self._reader = self._writer = None
+
+	@asyncio.coroutine
+	def command(self, name, ingest, until=None, **fields):
+		"""
+		Sends a LocalCommand and returns the readings the XMLIngest produces from the
+		response. until is the tag of the element the response is expected to end with, if known
+		"""
+		body = ' <Name>{0}</Name>\n'.format(name)
+		body += ''.join(' <{0}>{1}</{0}>\n'.format(key, value) for key, value in fields.items())
+		payload = '<LocalCommand>\n{0}</LocalCommand>\n'.format(body).encode('utf-8')
+		for attempt in range(2):
+			reused = self._writer is not None
+			if not reused:
+				yield from self._connect()
+			try:
+				self._writer.write(payload)
+				stream = ingest.stream(fragments=True)
+				closed = yield from self._read_response(stream, until)
+			except (OSError, asyncio.TimeoutError, ET.ParseError):
+				self.close()
+				if reused:
+					# the kept connection went stale; retry on a fresh one
+					continue
+				raise
+			if closed:
+				self.close()
+				self.persistent = False
+				if reused and not stream.count:
+					# the Eagle had closed the kept connection after the last response
+					continue
+			elif reused:
+				self.persistent = True
+			elif self.persistent is False:
+				# the Eagle does not keep connections open; reconnect on the next command
+				self.close()
+			return stream.close()
+		return []
+
+	@asyncio.coroutine
+	def _read_response(self, stream, until=None):
+		"""
+		Feeds the response into stream. Returns whether the Eagle closed the connection
+		"""
+		while True:
+			complete = stream.count and stream.depth == 0
+			try:
+				chunk = yield from asyncio.wait_for(self._reader.read(4096), self.idle if complete else self.timeout)
+			except asyncio.TimeoutError:
+				if complete:
+					return False
+				raise
+			if not chunk:
+				return True
+			stream.feed(chunk)
+			if stream.depth == 0 and stream.last == until:
+				return False
 
 class RainforestEagleDriver(driver.Driver):
 	def setup(self, opts):
@@ -10,73 +100,60 @@ class RainforestEagleDriver(driver.Driver):
 		self.poll_rate = int(opts.get('poll_rate', 10))
 		self.url = opts.get('url')
 		self.multiplier = int(opts.get('multiplier', 1))
+		self.client = EagleClient(self.url, int(opts.get('port', 5002)), connect_delay=float(opts.get('connect_delay', 1)))
+		self.name = opts.get('name')
+		self.deviceID = opts.get('deviceID')
+		# fields of the Eagle's DeviceInfo, read on the first poll
+		self.device = None
 
-		xml = self.list_devices()
-		root = ET.fromstring(xml)
+		self.demand_ts = self.add_timeseries("/eagle/demand", "kW", "milliseconds", "numeric")
+		self.received_ts = self.add_timeseries("/eagle/summation_received", "kWh", "milliseconds", "numeric")
+		self.delivered_ts = self.add_timeseries("/eagle/summation_delivered", "kWh", "milliseconds", "numeric")
+
+		# readings of a get_device_data response, and the fields of the DeviceInfo element
+		# of a list_devices response
+		self.ingest = XMLIngest()
+		self.ingest.on('InstantaneousDemand', self.demand)
+		self.ingest.on('CurrentSummation', self.summation)
+		self.device_ingest = XMLIngest()
+		self.device_ingest.on('DeviceInfo', self.device_info)
+
+	def device_info(self, elem):
 		self.device = {}
-		for child in root:
+		for child in elem:
 			self.device[child.tag] = child.text
-		
-		self.add_timeseries("/eagle/demand", "kW", "milliseconds", "numeric")
-		self.add_timeseries("/eagle/summation_received", "kWh", "milliseconds", "numeric")
-		self.add_timeseries("/eagle/summation_delivered", "kWh", "milliseconds", "numeric")
+
+	@asyncio.coroutine
+	def list_devices(self):
+		yield from self.client.command('list_devices', self.device_ingest, until='DeviceInfo')
 		for path, timeseries in self.timeseries.items():
 			self.attach_metadata(path, {'Device': {
 											'Manufacturer': self.device['Manufacturer'],
 											'Model': self.device['ModelId']},
-										'DeviceID': opts.get('deviceID'),
-										'Name': opts.get('name')
+										'DeviceID': self.deviceID,
+										'Name': self.name
 										})
 
-	def list_devices(self):
-		s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		s.settimeout(5)
-		s.connect((self.url, 5002))
-		time.sleep(1)
-
-		command = "<LocalCommand>\n <Name>list_devices</Name>\n</LocalCommand>\n"
-		s.send(bytes(command, 'UTF-8'))
-		return self.buffer_response(s)
-
-	def get_device_data(self, mac_id):
-		s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		s.settimeout(5)
-		s.connect((self.url, 5002))
-		time.sleep(1)
-
-		command = '<LocalCommand>\n <Name>get_device_data</Name>\n <MacId>%s</MacId>\n</LocalCommand>\n' % mac_id
-		s.send(bytes(command, 'UTF-8'))
-
-		return self.buffer_response(s)
-
-	@staticmethod
-	def buffer_response(s):
-		rv = bytearray()
-		while 1:
-			buf = s.recv(1024)
-			if not buf:
-				break
-			rv += buf
-
-		s.close()
-		return rv.decode(encoding='UTF-8')
-
 	def start(self):
 		self.startPoll(self.poll, self.poll_rate)
 
+	@asyncio.coroutine
+	def close(self):
+		self.client.close()
+		yield from super().close()
+
+	@asyncio.coroutine
 	def poll(self):
 		try:
-			xml = self.get_device_data(self.device['DeviceMacId'])
-			# wrap in root element since response aint valid xml!
-			xml = "<xml>\n" + xml + "\n</xml>"
-			root = ET.fromstring(xml)
-		
-			# add demand reading
-			ID = root.find('InstantaneousDemand')
+			if self.device is None:
+				yield from self.list_devices()
+			readings = yield from self.client.command('get_device_data', self.ingest, until='CurrentSummation', MacId=self.device['DeviceMacId'])
 		except Exception as e:
 			print(e)
 			return
+		self.add_many(readings)
 
+	def demand(self, ID):
 		try:
 			timestamp = int(ID.find('TimeStamp').text, 16)
 			demand = int(ID.find('Demand').text, 16)
@@ -84,15 +161,14 @@ class RainforestEagleDriver(driver.Driver):
 			ddivisor = int(ID.find('Divisor').text, 16)
 			fdemand = 1. * demand * dmultiplier / ddivisor
 			fdemand *= self.multiplier
-			self.add('/eagle/demand', fdemand)
 			print('demand:', fdemand, 'kW')
+			return [(self.demand_ts, fdemand)]
 		except ZeroDivisionError:
 			pass
 		except AttributeError:
 			pass
-	   
-		# add summation readings
-		CS = root.find('CurrentSummation')
+
+	def summation(self, CS):
 		try:
 			delivered = int(CS.find('SummationDelivered').text, 16)
 			received = int(CS.find('SummationReceived').text, 16)
@@ -102,9 +178,8 @@ class RainforestEagleDriver(driver.Driver):
 			freceived = 1. * received * smultiplier / sdivisor
 			fdelivered *= self.multiplier
 			freceived *= self.multiplier
-			self.add('/eagle/summation_delivered', fdelivered)
-			self.add('/eagle/summation_received', freceived)
 			print('delivered:', fdelivered, 'kWh')
 			print('received:', freceived, 'kWh')
+			return [(self.delivered_ts, fdelivered), (self.received_ts, freceived)]
 		except AttributeError:
 			pass
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Fake Rainforest Eagle for test_eagle.py and for trying out the driver without a meter:
+answers the list_devices and get_device_data local API commands on TCP port 5002 with made-up
+readings. Responses are written in small pieces to exercise incremental parsing. Like the real
+Eagle, it closes the connection after each response unless started with --keepalive. Point the
+url of eagle.ini at the host running this.
+"""
+
+import re
+import time
+import random
+import asyncio
+import argparse
+
+DEVICE_INFO = """<DeviceInfo>
+  <DeviceMacId>0xd8d5b90000001234</DeviceMacId>
+  <InstallCode>0x1234567890abcdef</InstallCode>
+  <LinkKey>0x00112233445566778899aabbccddeeff</LinkKey>
+  <FWVersion>1.4.48 (6952)</FWVersion>
+  <HWVersion>1.2.3</HWVersion>
+  <ImageType>0x1301</ImageType>
+  <Manufacturer>Rainforest Automation, Inc.</Manufacturer>
+  <ModelId>Z109-EAGLE</ModelId>
+  <DateCode>2013103023220630</DateCode>
+</DeviceInfo>
+"""
+
+DEVICE_DATA = """<NetworkInfo>
+  <DeviceMacId>0xd8d5b90000001234</DeviceMacId>
+  <CoordMacId>0x000781000086d0fe</CoordMacId>
+  <Status>Connected</Status>
+  <LinkStrength>0x64</LinkStrength>
+</NetworkInfo>
+<InstantaneousDemand>
+  <DeviceMacId>0xd8d5b90000001234</DeviceMacId>
+  <TimeStamp>{timestamp:#x}</TimeStamp>
+  <Demand>{demand:#08x}</Demand>
+  <Multiplier>0x00000001</Multiplier>
+  <Divisor>0x000003e8</Divisor>
+  <DigitsRight>0x03</DigitsRight>
+  <DigitsLeft>0x0f</DigitsLeft>
+  <SuppressLeadingZero>Y</SuppressLeadingZero>
+</InstantaneousDemand>
+<CurrentSummation>
+  <DeviceMacId>0xd8d5b90000001234</DeviceMacId>
+  <TimeStamp>{timestamp:#x}</TimeStamp>
+  <SummationDelivered>{delivered:#010x}</SummationDelivered>
+  <SummationReceived>0x00000000</SummationReceived>
+  <Multiplier>0x00000001</Multiplier>
+  <Divisor>0x000003e8</Divisor>
+  <DigitsRight>0x01</DigitsRight>
+  <DigitsLeft>0x06</DigitsLeft>
+  <SuppressLeadingZero>Y</SuppressLeadingZero>
+</CurrentSummation>
+"""
+
+# seconds between 2000-01-01 (the Eagle's epoch) and the POSIX epoch
+EAGLE_EPOCH = 946684800
+
+class FakeEagle(object):
+    def __init__(self, keepalive=False, chunk=64):
+        self.keepalive = keepalive
+        self.chunk = chunk
+        self.delivered = 1000000
+
+    def respond(self, command):
+        name = re.search(r'<Name>\s*(\w+)\s*</Name>', command)
+        name = name.group(1) if name else None
+        if name == 'list_devices':
+            return DEVICE_INFO
+        if name == 'get_device_data':
+            demand = random.randint(200, 3000)
+            self.delivered += demand // 100
+            return DEVICE_DATA.format(timestamp=int(time.time()) - EAGLE_EPOCH, demand=demand, delivered=self.delivered)
+        return ''
+
+    @asyncio.coroutine
+    def handle(self, reader, writer):
+        buf = b''
+        try:
+            while True:
+                data = yield from reader.read(1024)
+                if not data:
+                    return
+                buf += data
+                while b'</LocalCommand>' in buf:
+                    command, buf = buf.split(b'</LocalCommand>', 1)
+                    response = self.respond(command.decode('utf-8')).encode('utf-8')
+                    for i in range(0, len(response), self.chunk):
+                        writer.write(response[i:i+self.chunk])
+                        yield from writer.drain()
+                        yield from asyncio.sleep(0.001)
+                    if not self.keepalive:
+                        return
+        finally:
+            writer.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-host", action="store", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("-port", action="store", type=int, default=5002, help="Port to listen on")
+    parser.add_argument("--keepalive", action="store_true", help="Keep connections open between commands")
+    args = parser.parse_args()
+
+    eagle = FakeEagle(args.keepalive)
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(eagle.handle, args.host, args.port))
+    print("Fake Eagle listening on {0} port {1}".format(args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.close()
@@ -0,0 +1,76 @@
+"""
+Runs the Eagle driver's EagleClient against FakeEagle, both when the Eagle closes the
+connection after every response and when it keeps it open between commands.
+
+    cd python3 && python3 -m pytest XBOSDriver/drivers/rainforest_eagle/test_eagle.py
+"""
+
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_eagle import FakeEagle
+from XBOSDriver.drivers.rainforest_eagle import RainforestEagleDriver
+
+POLLS = 3
+
+class EagleClientTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        # let the FakeEagle handlers of closed connections finish
+        pending = asyncio.all_tasks(self.loop)
+        for task in pending:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def poll(self, keepalive):
+        """
+        Polls a FakeEagle POLLS times through a driver and returns the driver
+        """
+        fake = FakeEagle(keepalive)
+        server = self.loop.run_until_complete(asyncio.start_server(fake.handle, '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+        driver = RainforestEagleDriver({'instance_uuid': 'a201db46-e04f-11e5-941b-5cc5d4ded1ae'}, None)
+        driver.setup({'url': '127.0.0.1', 'port': str(port), 'connect_delay': '0'})
+        driver.prepare()
+        try:
+            for i in range(POLLS):
+                self.loop.run_until_complete(driver.poll())
+        finally:
+            self.loop.run_until_complete(driver.close())
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+        return driver
+
+    def check_readings(self, driver):
+        self.assertEqual(driver.device['ModelId'], 'Z109-EAGLE')
+        for path in ('/eagle/demand', '/eagle/summation_delivered', '/eagle/summation_received'):
+            self.assertEqual(len(driver.timeseries[path].buffer), POLLS, path)
+        for demand in driver.timeseries['/eagle/demand'].buffer.values:
+            self.assertTrue(0.2 <= demand <= 3.0)
+        delivered = list(driver.timeseries['/eagle/summation_delivered'].buffer.values)
+        self.assertEqual(delivered, sorted(delivered))
+
+    def test_reconnect_per_command(self):
+        driver = self.poll(keepalive=False)
+        self.check_readings(driver)
+        # list_devices, then get_device_data on each poll, each on its own connection
+        self.assertEqual(driver.client.connects, POLLS + 1)
+        self.assertIs(driver.client.persistent, False)
+
+    def test_kept_connection(self):
+        driver = self.poll(keepalive=True)
+        self.check_readings(driver)
+        self.assertEqual(driver.client.connects, 1)
+        self.assertIs(driver.client.persistent, True)
+
+if __name__ == '__main__':
+    unittest.main()
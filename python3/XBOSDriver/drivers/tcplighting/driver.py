@@ -1,4 +1,5 @@
 from XBOSDriver import driver
+from XBOSDriver.util import XMLIngest
 from lxml import etree
 import requests
 
@@ -91,15 +92,15 @@ class TCPBridge:
         parsed = etree.fromstring(xml)
 
     def get_states(self):
+        """
+        Returns (device id, state, power, level) for every device; level is None for devices without one
+        """
         resp = requests.post(self.posturl, headers=self.headers, data=self.command('GWRBatch', self.commands['State'].format(token=self.token)))
-        xml = resp.content
-        parsed = etree.fromstring(xml)
-        devices = parsed.xpath('//device')
-        device_ids = [x.find('did').text for x in devices]
-        states = [x.find('state').text for x in devices]
-        power = [x.find('power').text for x in devices]
-        levels = map(lambda x: x.text, filter(lambda x: x is not None, [x.find('level') for x in devices]))
-        return zip(device_ids, states, power, levels)
+        states = []
+        ingest = XMLIngest()
+        ingest.on('//device', lambda x: states.append((x.findtext('did'), x.findtext('state'), x.findtext('power'), x.findtext('level'))))
+        ingest.parse(resp.content)
+        return states
 
     def get_deviceinfo(self, token):
         resp = requests.post(self.posturl, headers=self.headers, data=self.command('GWRBatch',self.commands['Info'].format(token=self.token)))
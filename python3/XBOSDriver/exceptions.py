@@ -5,3 +5,5 @@ class TimestampException(Exception): pass
 class TimeseriesException(Exception): pass
 
 class SmapSocketException(Exception): pass
+
+class SubscriptionException(Exception): pass
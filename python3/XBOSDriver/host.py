@@ -0,0 +1,128 @@
+import os
+import glob
+import asyncio
+import logging
+import configparser
+
+from XBOSDriver.driver import make_session
+from XBOSDriver.outbound import ReportAggregator
+from XBOSDriver.exceptions import ValidationException
+
+logger = logging.getLogger('driver')
+
+def load_ini(path):
+    """
+    Reads the .ini file of a driver instance. Returns the driver class named by the driver
+    option of its [deployment] section, along with the deployment, instance and metadata
+    sections (metadata is None if the file has none)
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    if not config.read(path):
+        raise ValidationException("Could not read {0}".format(path))
+    for section in ('deployment', 'instance'):
+        if section not in config.sections():
+            raise ValidationException("{0} needs [{1}] section".format(path, section))
+    deployment = config['deployment']
+    if 'driver' not in deployment:
+        raise ValidationException("{0} needs a driver option in its [deployment] section".format(path))
+    drivername = deployment.pop('driver')
+    name = drivername.split('.')[-1]
+    pkg = '.'.join(drivername.split('.')[:-1])
+    mod = __import__(pkg, fromlist=[name])
+    driver = getattr(mod, name)
+    metadata = config['metadata'] if 'metadata' in config.sections() else None
+    return driver, deployment, config['instance'], metadata
+
+class DriverHost(object):
+    """
+    Runs the driver instances of every .ini file in a directory on one event loop, in one
+    process. The instances share one connection-pooled HTTP session, so those reporting to
+    the same archiver reuse the same connections. An instance that fails to load, start or
+    run is logged and stopped on its own; the others keep running. With report_window set,
+    reports of different instances to the same destination are merged by a ReportAggregator
+    """
+    def __init__(self, directory, config=None, paths=None):
+        self.directory = directory
+        # .ini files to run instead of all of those in directory, e.g. one shard of a Supervisor
+        self._paths = paths
+        # options for the shared session, as taken by make_session, and for the report
+        # aggregator, as taken by ReportAggregator.from_config
+        self.config = config if config is not None else {}
+        # .ini path -> running Driver instance
+        self.instances = {}
+        self._loop = None
+        self._session = None
+        self._aggregator = None
+
+    def paths(self):
+        """
+        The .ini files of the instances to run, in a stable order
+        """
+        if self._paths is not None:
+            return sorted(self._paths)
+        return sorted(glob.glob(os.path.join(self.directory, '*.ini')))
+
+    def start_instance(self, path):
+        """
+        Loads and starts the instance configured in the .ini file at path. Returns a coroutine
+        running the instance until it finishes or fails, or None if it could not be started
+        """
+        try:
+            klass, deployment, opts, metadata = load_ini(path)
+            inst = klass(deployment, metadata, session=self._session, aggregator=self._aggregator)
+            inst.setup(opts)
+            inst.prepare()
+            inst.start()
+        except Exception:
+            logger.exception("Could not start {0}".format(path))
+            return None
+        self.instances[path] = inst
+        return self._supervise(path, inst)
+
+    @asyncio.coroutine
+    def _supervise(self, path, inst):
+        """
+        Runs the tasks of an instance. If one of them fails, the rest are cancelled and the
+        instance is closed
+        """
+        tasks = [asyncio.ensure_future(task, loop=self._loop) for task in inst._tasks]
+        try:
+            if tasks:
+                done, pending = yield from asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in pending:
+                    task.cancel()
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        logger.error("{0} failed, stopping it".format(path), exc_info=task.exception())
+        finally:
+            self.instances.pop(path, None)
+            yield from inst.close()
+
+    def run(self):
+        """
+        Starts every instance and runs the event loop until all of them have stopped
+        """
+        self._loop = asyncio.get_event_loop()
+        self._session = make_session(self.config, self._loop)
+        self._aggregator = ReportAggregator.from_config(self.config, self._loop, self._session)
+        supervisors = [asyncio.ensure_future(supervisor, loop=self._loop)
+                       for supervisor in map(self.start_instance, self.paths()) if supervisor is not None]
+        logger.info("Hosting {0} driver instances".format(len(supervisors)))
+        try:
+            if supervisors:
+                self._loop.run_until_complete(asyncio.wait(supervisors))
+        finally:
+            self._loop.run_until_complete(self.close())
+
+    @asyncio.coroutine
+    def close(self):
+        """
+        Closes the running instances and the shared session
+        """
+        for inst in list(self.instances.values()):
+            yield from inst.close()
+        self.instances.clear()
+        if self._session is not None:
+            yield from self._session.close()
+            self._session = None
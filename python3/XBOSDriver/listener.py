@@ -0,0 +1,136 @@
+import socket
+import asyncio
+import logging
+
+logger = logging.getLogger('driver')
+
+class DatagramListener(object):
+    """
+    Receives datagrams on a non-blocking UDP socket into a preallocated buffer. Each time the
+    socket becomes readable, everything queued on it (up to max_batch datagrams) is read and
+    handed to dispatch as one list of (addr, data) pairs. asyncio's own datagram transport
+    reads a single datagram per wakeup, which defeats batching under load
+    """
+    def __init__(self, loop, sock, dispatch, bufsize=65536, max_batch=256):
+        self._loop = loop
+        self._sock = sock
+        self._dispatch = dispatch
+        self._view = memoryview(bytearray(bufsize))
+        self.max_batch = max_batch
+        sock.setblocking(False)
+        loop.add_reader(sock.fileno(), self._read_ready)
+
+    @staticmethod
+    def open_socket(host, port, v6only=False):
+        """
+        Returns a UDP socket bound to (host, port). A socket bound to an IPv6 address such as
+        '::' also receives IPv4 datagrams where the OS supports dual-stack sockets, unless
+        v6only is set
+        """
+        family, type, proto, _, addr = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM, flags=socket.AI_PASSIVE)[0]
+        sock = socket.socket(family, type, proto)
+        try:
+            if family == socket.AF_INET6 and hasattr(socket, 'IPV6_V6ONLY'):
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1 if v6only else 0)
+            sock.bind(addr)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    @classmethod
+    def bind(klass, loop, host, port, dispatch, v6only=False, **kwargs):
+        """
+        Creates a listener on a socket bound to (host, port), as by open_socket
+        """
+        return klass(loop, klass.open_socket(host, port, v6only), dispatch, **kwargs)
+
+    def _read_ready(self):
+        packets = []
+        view = self._view
+        while len(packets) < self.max_batch:
+            try:
+                nbytes, addr = self._sock.recvfrom_into(view)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                logger.warning("UDP listener error: {0}".format(e))
+                break
+            packets.append((addr, bytes(view[:nbytes])))
+        if packets:
+            self._dispatch(packets)
+
+    def close(self):
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+
+class StreamListener(getattr(asyncio, 'BufferedProtocol', asyncio.Protocol)):
+    """
+    Receives one TCP connection into a preallocated buffer of bufsize bytes. Everything that
+    arrives during one event loop iteration is handed to dispatch as a single (addr, data)
+    pair, or sooner if the buffer fills up. On Pythons without asyncio.BufferedProtocol,
+    received chunks are copied into the same buffer
+    """
+    def __init__(self, loop, dispatch, bufsize=65536):
+        self._loop = loop
+        self._dispatch = dispatch
+        self._buffer = bytearray(bufsize)
+        self._view = memoryview(self._buffer)
+        # bytes received and not dispatched yet
+        self._used = 0
+        self._addr = None
+
+    @staticmethod
+    def open_socket(host, port, backlog=100):
+        """
+        Returns a TCP socket listening on (host, port), for loop.create_server(sock=...). With
+        host None it listens on all IPv6 addresses and, where the OS supports dual-stack
+        sockets, all IPv4 addresses, or on all IPv4 addresses if IPv6 is not available
+        """
+        if host is None:
+            host = '::' if socket.has_ipv6 else '0.0.0.0'
+        family, type, proto, _, addr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+        sock = socket.socket(family, type, proto)
+        try:
+            if hasattr(socket, 'SO_REUSEADDR'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if family == socket.AF_INET6 and hasattr(socket, 'IPV6_V6ONLY'):
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            sock.bind(addr)
+            sock.listen(backlog)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def connection_made(self, transport):
+        self._addr = transport.get_extra_info('peername')
+
+    def get_buffer(self, sizehint):
+        if self._used == len(self._buffer):
+            self._flush()
+        return self._view[self._used:]
+
+    def buffer_updated(self, nbytes):
+        if not self._used:
+            self._loop.call_soon(self._flush)
+        self._used += nbytes
+
+    def data_received(self, data):
+        data = memoryview(data)
+        while data:
+            view = self.get_buffer(len(data))
+            n = min(len(view), len(data))
+            view[:n] = data[:n]
+            self.buffer_updated(n)
+            data = data[n:]
+
+    def connection_lost(self, exc):
+        self._flush()
+
+    def _flush(self):
+        if not self._used:
+            return
+        data = bytes(self._view[:self._used])
+        self._used = 0
+        self._dispatch([(self._addr, data)])
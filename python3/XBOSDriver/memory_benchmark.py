@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+Measures the memory a driver spends per timeseries: registers -n timeseries with a few
+common unit/type combinations, the base metadata of an .ini [metadata] section and some
+point metadata, makes every -actuators'th one an actuator, then adds -readings readings
+to each. Prints the bytes allocated per timeseries after each step, as traced by tracemalloc.
+
+    python3 -m XBOSDriver.memory_benchmark -n 20000
+"""
+
+import gc
+import argparse
+import tracemalloc
+
+from XBOSDriver import driver
+
+UNITS = [('F', 'Sensor'), ('%RH', 'Sensor'), ('Mode', 'Reading'), ('kW', 'Sensor'), ('On/Off', 'Command')]
+
+BASE_METADATA = {
+    'Location/Building': 'Soda Hall',
+    'Location/Room': '410',
+    'SourceName': 'Memory Benchmark',
+}
+
+class BenchmarkDriver(driver.Driver):
+    def setup(self, opts):
+        count, actuators = opts['count'], opts['actuators']
+        for i in range(count):
+            unit, kind = UNITS[i % len(UNITS)]
+            path = self.add_timeseries('/point{0}'.format(i), unit, 'milliseconds', 'numeric')
+            self.attach_metadata(path, {'Point': {'Type': kind}})
+            if actuators and i % actuators == 0:
+                self.attach_actuator(path, self.write, kind=driver.CONTINUOUS_ACTUATOR)
+
+    def write(self, data, *args):
+        pass
+
+def traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+def run(count, actuators, readings):
+    tracemalloc.start()
+    start = traced()
+    inst = BenchmarkDriver({'instance_uuid': '2b8e4a3c-0bd6-11e6-a9b3-0cc47a0f7eea'}, BASE_METADATA)
+    inst.setup({'count': count, 'actuators': actuators})
+    registered = traced()
+    for i in range(readings):
+        for path in inst.timeseries:
+            inst.add(path, float(i))
+    filled = traced()
+    tracemalloc.stop()
+    print("{0} timeseries, every {1}th an actuator".format(count, actuators) if actuators else "{0} timeseries".format(count))
+    print("registered: {0:8.1f} bytes per timeseries".format((registered - start) / count))
+    print("{0} readings: {1:8.1f} bytes per timeseries".format(readings, (filled - start) / count))
+    return inst
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", action="store", type=int, default=10000, help="Number of timeseries")
+    parser.add_argument("-actuators", action="store", type=int, default=10, help="Make every nth timeseries an actuator (0 for none)")
+    parser.add_argument("-readings", action="store", type=int, default=1, help="Readings added to each timeseries")
+    args = parser.parse_args()
+    run(args.n, args.actuators, args.readings)
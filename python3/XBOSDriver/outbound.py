@@ -0,0 +1,322 @@
+import gzip
+import asyncio
+import logging
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from XBOSDriver.exceptions import ValidationException
+import XBOSDriver.serializer as serializer
+
+logger = logging.getLogger('driver')
+
+# Content-Encodings report payloads can be sent with
+ENCODING_GZIP = 'gzip'
+ENCODING_ZSTD = 'zstd'
+ENCODINGS = [ENCODING_GZIP, ENCODING_ZSTD]
+
+def encode(payload, encoding):
+    """
+    Compresses the payload bytes with the given Content-Encoding
+    """
+    if encoding == ENCODING_GZIP:
+        return gzip.compress(payload, 6)
+    if encoding == ENCODING_ZSTD:
+        return zstandard.ZstdCompressor().compress(payload)
+    return payload
+
+class Report(object):
+    """
+    A report prepared for one destination. marks records, for each path in the report,
+    the sequence number just past its last included reading and the metadata version
+    and blocks it carried, so that acknowledging the report only commits what was sent.
+    partial is set if readings were left out to respect a size limit
+    """
+    def __init__(self, seq, report, marks, partial=False):
+        self.seq = seq
+        self.report = report
+        self.marks = marks
+        self.partial = partial
+
+    def __len__(self):
+        return sum(len(ts['Readings']) for ts in self.report.values())
+
+class Destination(object):
+    """
+    An archiver that reports are sent to. Each destination keeps its own cursor into every
+    timeseries buffer, so readings are only dropped once every destination acknowledged them
+    """
+    def __init__(self, url, encoding=None):
+        self.url = url
+        if encoding is not None and encoding not in ENCODINGS:
+            raise ValidationException("Encoding {0} for {1} must be one of {2}".format(encoding, url, ENCODINGS))
+        if encoding == ENCODING_ZSTD and zstandard is None:
+            logger.warning("zstandard is not installed, sending gzip to {0}".format(url))
+            encoding = ENCODING_GZIP
+        # Content-Encoding of the reports, or None to send them uncompressed
+        self.encoding = encoding
+        # path -> sequence number of the first reading not yet acknowledged
+        self.cursors = {}
+        # path -> (metadata version, metadata blocks) as last acknowledged
+        self.committed = {}
+        # sequence number of the next report; advances when a report is acknowledged
+        self.seq = 0
+        # whether reports are being sent to this destination right now
+        self.busy = False
+
+    def __repr__(self):
+        return "<Destination {0} seq={1}>".format(self.url, self.seq)
+
+    @classmethod
+    def from_config(klass, entry):
+        """
+        Parses one report_destinations entry: a URL, optionally followed by the
+        Content-Encoding to compress reports with, e.g. "http://localhost:8079/add/apikey gzip"
+        """
+        parts = entry.split()
+        return klass(parts[0], parts[1] if len(parts) > 1 else None)
+
+    def cursor(self, path, ts):
+        return max(self.cursors.get(path, 0), ts.buffer.start_seq)
+
+    def prepare(self, timeseries, limit=0):
+        """
+        Builds the next report out of everything in the given {path: Timeseries} map that this
+        destination has not acknowledged yet, holding at most limit readings (0 for no limit).
+        Returns None if there is nothing to send
+        """
+        report, marks = {}, {}
+        budget, partial = limit, False
+        for path, ts in timeseries.items():
+            start = self.cursor(path, ts)
+            end = ts.buffer.end_seq
+            if limit and end - start > budget:
+                end = start + budget
+                partial = True
+            budget -= end - start
+            committed = self.committed.get(path)
+            if start == end and committed is not None and committed[0] == ts.version:
+                continue
+            report[path] = ts.get_report(start, end, committed)
+            marks[path] = (end, ts.version, ts.metadata_blocks())
+        if not report:
+            return None
+        return Report(self.seq, report, marks, partial)
+
+    def acknowledge(self, report):
+        """
+        Advances the cursors and committed metadata past the given report
+        """
+        for path, (end, version, blocks) in report.marks.items():
+            self.cursors[path] = end
+            self.committed[path] = (version, blocks)
+        self.seq = report.seq + 1
+
+    def resync(self):
+        """
+        Forgets the committed metadata so that the next report carries the full blocks
+        """
+        self.committed.clear()
+
+class FlushPolicy(object):
+    """
+    Triggers a report ahead of the regular report interval once max_readings readings or about
+    max_bytes of payload have been added, or once the oldest unreported reading is max_age
+    seconds old, whichever comes first. A limit of 0 disables that trigger. max_readings and
+    max_bytes also bound the size of every report; larger backlogs go out in several chunks
+    """
+    # rough size of one serialized reading, used to estimate the payload size of added readings
+    READING_BYTES = 32
+
+    def __init__(self, loop, trigger, max_readings=0, max_bytes=0, max_age=0):
+        self._loop = loop
+        # called without arguments when a report is due
+        self._trigger = trigger
+        self.max_readings = max_readings
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # readings added since the last report
+        self.pending = 0
+        # fires max_age after the first reading added since the last report, at loop time _due
+        self._timer = None
+        self._due = None
+
+    @classmethod
+    def from_config(klass, config, loop, trigger):
+        """
+        Returns the policy configured with flush_max_readings, flush_max_bytes and flush_max_age,
+        or None if none is set and reports only go out every report interval
+        """
+        max_readings = int(config.get('flush_max_readings', 0))
+        max_bytes = int(config.get('flush_max_bytes', 0))
+        max_age = float(config.get('flush_max_age', 0))
+        if not (max_readings or max_bytes or max_age):
+            return None
+        return klass(loop, trigger, max_readings, max_bytes, max_age)
+
+    def added(self, count):
+        self.pending += count
+        if self.max_age and self._timer is None:
+            self._due = self._loop.time() + self.max_age
+            self._timer = self._loop.call_at(self._due, self._trigger)
+        if self.max_readings and self.pending >= self.max_readings:
+            self._trigger()
+        elif self.max_bytes and self.pending * self.READING_BYTES >= self.max_bytes:
+            self._trigger()
+
+    def due(self):
+        """
+        Returns whether a limit has been reached since the last report, e.g. because the report
+        it triggered could not go out yet
+        """
+        if self.max_readings and self.pending >= self.max_readings:
+            return True
+        if self.max_bytes and self.pending * self.READING_BYTES >= self.max_bytes:
+            return True
+        return self._due is not None and self._due <= self._loop.time()
+
+    def reset(self):
+        self.pending = 0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            self._due = None
+
+class ReportAggregator(object):
+    """
+    Coalesces the reports of the driver instances of a host that go to the same destination
+    URL: reports requested within window seconds of each other are merged, keyed by
+    timeseries uuid (with the path under "Path"), into one POST of at most max_readings
+    readings and about max_bytes of payload (0 for no limit). Each instance keeps its own
+    Destination, so acknowledgments and cursors are still tracked per instance
+    """
+    def __init__(self, loop, session, window=5, max_readings=0, max_bytes=0):
+        self._loop = loop
+        self._session = session
+        self.window = window
+        self.max_readings = max_readings
+        self.max_bytes = max_bytes
+        # url -> [(Driver, Destination)] of the instances reporting there
+        self._members = {}
+        # url -> handle of the scheduled flush
+        self._scheduled = {}
+        # url -> loop time of the last flush
+        self._last = {}
+        # urls being sent to right now
+        self._busy = set()
+
+    @classmethod
+    def from_config(klass, config, loop, session):
+        """
+        Returns the aggregator configured with report_window, flush_max_readings and
+        flush_max_bytes, or None if report_window is 0 (the default) and instances report
+        separately. Merged reports are keyed by uuid rather than path, which the archiver has
+        to accept, so merging is opt-in
+        """
+        window = float(config.get('report_window', 0))
+        if not window:
+            return None
+        return klass(loop, session, window, int(config.get('flush_max_readings', 0)),
+                     int(config.get('flush_max_bytes', 0)))
+
+    def join(self, driver):
+        for destination in driver._destinations:
+            self._members.setdefault(destination.url, []).append((driver, destination))
+
+    def leave(self, driver):
+        for url, members in self._members.items():
+            members[:] = [member for member in members if member[0] is not driver]
+
+    def request(self, url):
+        """
+        Asks for a report to url, sent at most window seconds later together with those
+        requested by the other instances in the meantime
+        """
+        if url in self._scheduled:
+            return
+        when = max(self._last.get(url, 0) + self.window, self._loop.time())
+        self._scheduled[url] = self._loop.call_at(when, self._flush, url)
+
+    def _flush(self, url):
+        del self._scheduled[url]
+        if url in self._busy:
+            # still sending the previous window; try again once that is done
+            self.request(url)
+            return
+        self._busy.add(url)
+        self._last[url] = self._loop.time()
+        self._loop.create_task(self._deliver(url))
+
+    def _prepare(self, url, limit):
+        """
+        Returns the reports of the instances for url holding at most limit readings in total
+        (0 for no limit), their merged payload, and whether readings were left out
+        """
+        parts, merged, partial = [], {}, False
+        budget = limit
+        for driver, destination in self._members.get(url, []):
+            if limit and budget <= 0:
+                partial = True
+                break
+            report = destination.prepare(driver.timeseries, budget)
+            if report is None:
+                continue
+            budget -= len(report)
+            partial = partial or report.partial
+            parts.append((driver, destination, report))
+            for path, entry in report.report.items():
+                entry["Path"] = path
+                merged[entry["uuid"]] = entry
+        return parts, merged, partial
+
+    @asyncio.coroutine
+    def _deliver(self, url):
+        """
+        Sends the merged reports of all instances for url, in chunks if they are bounded,
+        and acknowledges to each instance what it contributed
+        """
+        try:
+            members = self._members.get(url, [])
+            limit = self.max_readings
+            while members:
+                parts, merged, partial = self._prepare(url, limit)
+                if not parts:
+                    return
+                payload = serializer.dumps(merged)
+                count = sum(len(report) for driver, destination, report in parts)
+                if self.max_bytes and len(payload) > self.max_bytes and count > 1:
+                    limit = count // 2
+                    continue
+                limit = self.max_readings
+                encoding = members[0][1].encoding
+                headers = {'Content-type': 'application/json'}
+                if encoding is not None:
+                    headers['Content-Encoding'] = encoding
+                logger.info("Sending {0} merged reports to {1}...".format(len(parts), url))
+                response = yield from self._session.post(url, data=encode(payload, encoding), headers=headers)
+                if response.status in (400, 415) and encoding is not None:
+                    logger.warning("{0} rejected {1} report: {2}. Sending uncompressed".format(url, encoding, response.status))
+                    for driver, destination in members:
+                        destination.encoding = None
+                    yield from response.release()
+                    continue
+                ok = response.status == 200
+                if ok:
+                    logger.info("Merged report to {0} OK".format(url))
+                    for driver, destination, report in parts:
+                        destination.acknowledge(report)
+                        driver._trim()
+                else:
+                    logger.warning("Merged report to {0} failed: {1}".format(url, response.status))
+                yield from response.release()
+                if not ok or not partial:
+                    return
+        except Exception as e:
+            logger.warning("Merged report to {0} failed: {1}".format(url, e))
+        finally:
+            self._busy.discard(url)
+            # the next window starts with a different instance, so that a large backlog
+            # of one instance does not keep delaying the others
+            if len(members) > 1:
+                members.append(members.pop(0))
@@ -0,0 +1,233 @@
+import logging
+
+import XBOSDriver.util as util
+from XBOSDriver.timeseriestypes import STREAM_TYPE_NUMERIC, UNIT_TIME_MILLISECONDS
+from XBOSDriver.exceptions import ValidationException
+
+logger = logging.getLogger('driver')
+
+# parse= names accepted in point declarations of an .ini file
+PARSERS = {'float': float, 'int': int, 'str': str}
+
+class Point(object):
+    """
+    One compiled entry of a PointMap
+    """
+    __slots__ = ('name', 'key', 'path', 'unit', 'stream_type', 'convert', 'to_device', 'check', 'timeseries', 'value', 'rejected')
+
+    def __init__(self, name, key, path, unit, stream_type, convert, to_device, check):
+        self.name = name
+        # key of the point's raw value in what the device returns, e.g. an OID or JSON field
+        self.key = key
+        self.path = path
+        self.unit = unit
+        self.stream_type = stream_type
+        # raw device value -> reading, and reading -> device value, e.g. for actuators
+        self.convert = convert
+        self.to_device = to_device
+        # returns whether a converted reading is plausible, or None to accept all
+        self.check = check
+        # Timeseries of the point, resolved by PointMap.compile
+        self.timeseries = None
+        # reading of the current sample, None if absent or rejected
+        self.value = None
+        # readings that failed conversion or check
+        self.rejected = 0
+
+    def __repr__(self):
+        return "<Point {0} key={1} path={2} rejected={3}>".format(self.name, self.key, self.path, self.rejected)
+
+def _converters(parse, scale, offset, mapping):
+    if mapping is not None:
+        inverse = {}
+        for raw, value in mapping.items():
+            # several device values may map to one reading; write back the first
+            inverse.setdefault(value, raw)
+        return (lambda raw: mapping[parse(raw)]), inverse.__getitem__
+    if scale is not None or offset is not None:
+        # dividing by the reciprocal of decimal scales such as 0.1 gives 72.3 rather than
+        # 72.30000000000001 for a raw 723
+        divisor = 1 / (1 if scale is None else scale)
+        offset = 0 if offset is None else offset
+        return (lambda raw: parse(raw) / divisor + offset), (lambda value: (value - offset) * divisor)
+    return parse, parse
+
+def _check(range):
+    if range is None or callable(range):
+        return range
+    if isinstance(range, tuple):
+        low, high = range
+        return lambda value: low <= value <= high
+    # discrete set of valid readings
+    return frozenset(range).__contains__
+
+def parse_spec(spec):
+    """
+    Parses the declaration of a point in an .ini file into keyword arguments of
+    PointMap.declare. A declaration is a series of whitespace separated fields:
+
+        point.temp = key=OID4.1.13 unit=F scale=0.1 range=-30:200
+        point.hold = key=OID4.1.9 unit=Mode parse=int map=1:0,2:1,3:0
+
+    range=low:high is an interval and states=a,b,c a set of valid readings
+    """
+    kwargs = {}
+    for field in spec.split():
+        name, sep, value = field.partition('=')
+        if not sep:
+            raise ValidationException("Point field {0!r} of {1!r} is not name=value".format(field, spec))
+        kwargs[name] = value
+    parse = PARSERS.get(kwargs.get('parse', 'float'))
+    if parse is None:
+        raise ValidationException("parse must be one of {0}".format(sorted(PARSERS)))
+    kwargs['parse'] = parse
+    try:
+        for name in ('scale', 'offset'):
+            if name in kwargs:
+                kwargs[name] = float(kwargs[name])
+        if 'map' in kwargs:
+            pairs = [pair.split(':') for pair in kwargs['map'].split(',')]
+            kwargs['map'] = {parse(raw): float(value) for raw, value in pairs}
+        if 'range' in kwargs:
+            low, high = kwargs['range'].split(':')
+            kwargs['range'] = (float(low), float(high))
+        if 'states' in kwargs:
+            kwargs['range'] = [float(state) for state in kwargs.pop('states').split(',')]
+    except ValueError as e:
+        raise ValidationException("Bad point declaration {0!r}: {1}".format(spec, e))
+    return kwargs
+
+class PointMap(object):
+    """
+    Table of the points a driver reads from a device, compiled once at setup. Each point maps
+    the raw value the device returns under some key to a reading of one timeseries, through a
+    conversion and an optional plausibility check:
+
+        self.points = PointMap.from_config(opts, POINTS, strict=True)
+        self.points.compile(self)
+        ...
+        self.points.update({'OID4.1.13': '720', 'OID4.1.14': '40'})
+
+    update converts and checks the values of one sample and stores them directly into the
+    resolved timeseries, without building paths or looking them up. A value that does not
+    convert or fails its check is skipped; with strict set, it discards the whole sample, for
+    devices that return garbage across the board when they act up (e.g. while rebooting)
+    """
+    def __init__(self, strict=False, unit_time=UNIT_TIME_MILLISECONDS):
+        self.strict = strict
+        self.unit_time = unit_time
+        self.points = []
+        self._by_name = {}
+        self._driver = None
+
+    @classmethod
+    def from_config(cls, opts, defaults=(), strict=False, prefix='point.'):
+        """
+        Returns a map of the points declared in defaults (dicts of PointMap.declare arguments)
+        and by the point.<name> options of an .ini section, which add points or replace the
+        default of the same name
+        """
+        points = cls(strict)
+        for declaration in defaults:
+            points.declare(**declaration)
+        for option, spec in opts.items():
+            if option.startswith(prefix):
+                points.declare(option[len(prefix):], **parse_spec(spec))
+        return points
+
+    def declare(self, name, key, unit, path=None, parse=float, scale=None, offset=None, map=None, range=None, stream_type=STREAM_TYPE_NUMERIC):
+        """
+        Adds a point, or replaces the one of the same name. The raw value is parsed with parse,
+        then either looked up in map or multiplied by scale and shifted by offset. range is a
+        (low, high) interval, a list of valid readings or a predicate. path defaults to /name
+        """
+        if self._driver is not None:
+            raise ValidationException("Cannot declare point {0} after the map is compiled".format(name))
+        if stream_type == STREAM_TYPE_NUMERIC and map is not None:
+            if not all(isinstance(value, (int, float)) for value in map.values()):
+                raise ValidationException("Point {0} maps to readings that are not of type STREAM_TYPE_NUMERIC".format(name))
+        convert, to_device = _converters(parse, scale, offset, map)
+        point = Point(name, key, path or '/' + name, unit, stream_type, convert, to_device, _check(range))
+        old = self._by_name.get(name)
+        if old is not None:
+            self.points[self.points.index(old)] = point
+        else:
+            self.points.append(point)
+        self._by_name[name] = point
+        return point
+
+    def compile(self, driver):
+        """
+        Resolves the timeseries of every point, registering those the driver does not have yet
+        """
+        for point in self.points:
+            point.timeseries = driver.timeseries.get(point.path)
+            if point.timeseries is None:
+                point.timeseries = driver.add_timeseries(point.path, point.unit, self.unit_time, point.stream_type).timeseries
+        self._driver = driver
+        return self
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def keys(self):
+        """
+        Returns the distinct device keys to read, in declaration order
+        """
+        keys = []
+        for point in self.points:
+            if point.key not in keys:
+                keys.append(point.key)
+        return keys
+
+    def update(self, values, time=None):
+        """
+        Stores the readings of one sample. values maps device keys to raw values; points whose
+        key is missing are skipped. Returns False if a strict map discarded the sample
+        """
+        get = values.get
+        for point in self.points:
+            raw = get(point.key)
+            if raw is None:
+                point.value = None
+                continue
+            try:
+                value = point.convert(raw)
+            except (ValueError, TypeError, KeyError):
+                value = None
+            else:
+                if point.check is not None and not point.check(value):
+                    value = None
+            if value is None:
+                point.rejected += 1
+                logger.debug("Rejected value {0!r} of point {1}".format(raw, point.name))
+                if self.strict:
+                    point.value = None
+                    return False
+            point.value = value
+        driver = self._driver
+        if time is None:
+            time = util.get_current_time_as(self.unit_time)
+        if driver._off_loop():
+            # buffers are only touched from the loop; hand the readings over
+            readings = [(point.timeseries, point.value) for point in self.points if point.value is not None]
+            driver._loop.call_soon_threadsafe(self._store, readings, time)
+            return True
+        store = driver._store
+        for point in self.points:
+            if point.value is not None:
+                store(point.timeseries, time, point.value)
+        return True
+
+    def _store(self, readings, time):
+        for ts, value in readings:
+            self._driver._store(ts, time, value)
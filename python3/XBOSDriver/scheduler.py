@@ -0,0 +1,48 @@
+import random
+import asyncio
+
+def jittered_phase(period, jitter, key):
+    """
+    Returns the delay before the first tick of a ticker: period with no jitter, otherwise a
+    point in (period * (1 - jitter), period] picked deterministically from key, so that pollers
+    of different timeseries and driver instances spread out instead of firing together
+    """
+    if not jitter:
+        return period
+    return period * (1 - jitter * random.Random(key).random())
+
+class Ticker(object):
+    """
+    Fires every period seconds on the event loop's monotonic clock. Tick times are laid out
+    from the first tick rather than from when the previous tick's work finished, so slow work
+    does not make the schedule drift. Ticks that pass while the previous work is still running
+    are skipped and counted in missed instead of being run back to back
+    """
+    def __init__(self, loop, period, phase=None):
+        self._loop = loop
+        self.period = period
+        # delay before the first tick
+        self.phase = period if phase is None else phase
+        self.ticks = 0
+        self.missed = 0
+        # loop time of the next tick
+        self._next = None
+
+    def __repr__(self):
+        return "<Ticker period={0} ticks={1} missed={2}>".format(self.period, self.ticks, self.missed)
+
+    @asyncio.coroutine
+    def wait(self):
+        """
+        Sleeps until the next tick
+        """
+        now = self._loop.time()
+        if self._next is None:
+            self._next = now + self.phase
+        elif now > self._next:
+            skipped = int((now - self._next) // self.period) + 1
+            self.missed += skipped
+            self._next += skipped * self.period
+        yield from asyncio.sleep(self._next - now)
+        self._next += self.period
+        self.ticks += 1
@@ -0,0 +1,50 @@
+"""
+JSON encoding of reports and decoding of subscription messages. Uses orjson or ujson
+when one is installed and falls back to the standard library json module
+"""
+import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+from XBOSDriver.buffer import Readings
+
+def _default(obj):
+    # numeric readings go to the encoder as (time, value) tuples zipped off the columns
+    if isinstance(obj, Readings):
+        return list(obj)
+    raise TypeError("{0!r} is not JSON serializable".format(obj))
+
+if orjson is not None:
+    def dumps(obj):
+        """
+        Returns obj encoded as JSON bytes
+        """
+        return orjson.dumps(obj, default=_default)
+
+    def loads(data):
+        """
+        Decodes JSON from str, bytes, bytearray or memoryview
+        """
+        return orjson.loads(data)
+elif ujson is not None:
+    def dumps(obj):
+        return ujson.dumps(obj, default=_default).encode('utf-8')
+
+    def loads(data):
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        return ujson.loads(data)
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=_default).encode('utf-8')
+
+    def loads(data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data.decode('utf-8') if not isinstance(data, str) else data)
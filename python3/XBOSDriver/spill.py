@@ -0,0 +1,106 @@
+import os
+import mmap
+import json
+import uuid
+import struct
+
+from XBOSDriver.timeseriestypes import STREAM_TYPE_NUMERIC
+
+# read offset, write offset, number of unread records
+HEADER = struct.Struct('<QQQ')
+# timeseries uuid, time, payload length
+RECORD = struct.Struct('<16sqI')
+NUMERIC = struct.Struct('<d')
+
+class SpillFile(object):
+    """
+    Append-only, memory-mapped file holding readings that did not fit in memory while the
+    archiver was unreachable. Readings are appended at the write offset and drained in order
+    from the read offset. The offsets live in the file header, so a backlog left over by a
+    previous run is picked up again on startup
+    """
+    def __init__(self, path, size=1 << 20):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER.size
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), os.path.getsize(path))
+        if exists:
+            self._read, self._write, self._count = HEADER.unpack_from(self._map, 0)
+        else:
+            self._reset()
+        # uuid string -> 16 bytes, to avoid reparsing uuids for every reading
+        self._uuids = {}
+        # whether new readings should be appended here instead of kept in memory. Starts out
+        # set if there is a backlog left over so that it drains before newer readings
+        self.active = self._count > 0
+
+    def __len__(self):
+        return self._count
+
+    def _reset(self):
+        self._read = self._write = HEADER.size
+        self._count = 0
+        HEADER.pack_into(self._map, 0, self._read, self._write, self._count)
+
+    def _reserve(self, size):
+        if self._write + size <= len(self._map):
+            return
+        newsize = max(2 * len(self._map), self._write + size)
+        self._map.close()
+        self._file.truncate(newsize)
+        self._map = mmap.mmap(self._file.fileno(), newsize)
+
+    def append(self, ts, time, value):
+        """
+        Appends a reading of the given Timeseries
+        """
+        uuid_bytes = self._uuids.get(ts.uuid)
+        if uuid_bytes is None:
+            uuid_bytes = self._uuids[ts.uuid] = uuid.UUID(ts.uuid).bytes
+        if ts.stream_type == STREAM_TYPE_NUMERIC:
+            payload = NUMERIC.pack(value)
+        else:
+            payload = json.dumps(value).encode('utf-8')
+        self._reserve(RECORD.size + len(payload))
+        RECORD.pack_into(self._map, self._write, uuid_bytes, int(time), len(payload))
+        start = self._write + RECORD.size
+        self._map[start:start + len(payload)] = payload
+        self._write = start + len(payload)
+        self._count += 1
+        HEADER.pack_into(self._map, 0, self._read, self._write, self._count)
+
+    def read(self, limit, timeseries):
+        """
+        Removes up to limit of the oldest readings from the file and returns them as
+        (Timeseries, time, value) tuples. timeseries maps uuid strings to Timeseries;
+        readings of timeseries no longer registered are dropped
+        """
+        readings = []
+        offset = self._read
+        while self._count > 0 and len(readings) < limit:
+            uuid_bytes, time, length = RECORD.unpack_from(self._map, offset)
+            offset += RECORD.size
+            payload = self._map[offset:offset + length]
+            offset += length
+            self._count -= 1
+            ts = timeseries.get(str(uuid.UUID(bytes=uuid_bytes)))
+            if ts is None:
+                continue
+            if ts.stream_type == STREAM_TYPE_NUMERIC:
+                value = NUMERIC.unpack(payload)[0]
+            else:
+                value = json.loads(payload.decode('utf-8'))
+            readings.append((ts, time, value))
+        if self._count == 0:
+            self._reset()
+        else:
+            self._read = offset
+            HEADER.pack_into(self._map, 0, self._read, self._write, self._count)
+        return readings
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
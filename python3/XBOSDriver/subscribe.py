@@ -1,45 +1,292 @@
-import json
-import aiohttp
+import time
+import random
 import asyncio
+import logging
+
+import XBOSDriver.serializer as serializer
+from XBOSDriver.exceptions import SubscriptionException
+
+logger = logging.getLogger('driver')
+
+# connection states of a Subscriber
+STATE_CONNECTING = 'connecting'
+STATE_CONNECTED = 'connected'
+STATE_WAITING = 'waiting'
+
+class MessageFramer:
+    """
+    Splits a byte stream into delimiter-separated messages. Each chunk fed in is only scanned
+    from where the previous scan stopped, and messages are handed out as memoryviews into the
+    receive buffer instead of copies
+    """
+    def __init__(self, delimiter):
+        self.delimiter = delimiter
+        self._buffer = bytearray()
+        # offset the next delimiter search starts from
+        self._scanned = 0
+
+    def feed(self, chunk):
+        """
+        Adds received bytes and returns a generator over the complete messages they finish
+        """
+        buf = self._buffer
+        buf.extend(chunk)
+        bounds = []
+        start = 0
+        end = buf.find(self.delimiter, self._scanned)
+        while end != -1:
+            # consecutive delimiters, e.g. keepalives, frame no message
+            if end > start:
+                bounds.append((start, end))
+            start = end + len(self.delimiter)
+            end = buf.find(self.delimiter, start)
+        if start:
+            # the unfinished tail moves to a fresh buffer; this one is left as is for the
+            # views handed out below
+            self._buffer = buf[start:]
+        self._scanned = max(len(self._buffer) - len(self.delimiter) + 1, 0)
+        return self._messages(buf, bounds)
+
+    @staticmethod
+    def _messages(buf, bounds):
+        view = memoryview(buf)
+        for start, end in bounds:
+            yield view[start:end]
 
 class Subscriber:
+    """
+    A republish stream for one query. Whenever the connection fails or the stream ends, the
+    query is issued again after a random delay of up to min_backoff * 2**n seconds (capped
+    at max_backoff), n counting the failed attempts since messages last came through
+    """
     delimiter = b'\n\n'
+    # reads start at readsize bytes and double, up to max_readsize, while reads come back full
     readsize = 128
+    max_readsize = 65536
+    min_backoff = 1
+    max_backoff = 60
 
-    def __init__(self, subscribeURL, query, callback, args=[]):
+    def __init__(self, subscribeURL, query, callback, args=[], session=None, readsize=None, max_readsize=None):
         self.url = subscribeURL
         self.query = query
         self.cb = callback
         self.args = args
+        # aiohttp.ClientSession the subscription is made through; must be set before subscribe() runs
+        self.session = session
+        if readsize is not None:
+            self.readsize = readsize
+        if max_readsize is not None:
+            self.max_readsize = max_readsize
+        self._framer = MessageFramer(self.delimiter)
+        # one of STATE_CONNECTING, STATE_CONNECTED or STATE_WAITING (to reconnect)
+        self.state = STATE_CONNECTING
+        # times the stream was lost and reconnected
+        self.reconnects = 0
+        # time the current connection was made, and why the last one was lost
+        self.connected_at = None
+        self.last_error = None
+        # failed attempts since messages last came through
+        self._attempts = 0
 
+    def __repr__(self):
+        return "<Subscriber {0} {1} reconnects={2}>".format(self.query, self.state, self.reconnects)
+
+    @asyncio.coroutine
     def subscribe(self):
-        try:
-            print("subscribe to", self.url, self.query)
-            resp = yield from aiohttp.request("POST", self.url, data=self.query)
-        except Exception as e:
-            print(e)
-            return
+        """
+        Streams the messages of the query to the callback, reconnecting as needed
+        """
+        while True:
+            self.state = STATE_CONNECTING
+            try:
+                logger.info("Subscribing to {0} {1}".format(self.url, self.query))
+                # the session's read timeout covers the whole response, which for a stream
+                # that stays open indefinitely would cut it off every few minutes
+                resp = yield from self.session.post(self.url, data=self.query, timeout=None)
+                try:
+                    if resp.status != 200:
+                        raise SubscriptionException("{0} answered {1}".format(self.url, resp.status))
+                    self.state = STATE_CONNECTED
+                    self.connected_at = time.time()
+                    yield from self._stream(resp)
+                finally:
+                    yield from resp.release()
+                self.last_error = "stream ended"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = e
+            # a message cut off by the disconnect is dropped
+            self._framer = MessageFramer(self.delimiter)
+            delay = random.uniform(0, min(self.max_backoff, self.min_backoff * 2 ** self._attempts))
+            self._attempts += 1
+            self.reconnects += 1
+            self.state = STATE_WAITING
+            self.connected_at = None
+            logger.warning("Subscription {0} lost ({1}), reconnecting in {2:.1f}s".format(self.query, self.last_error, delay))
+            yield from asyncio.sleep(delay)
 
-        i = 0
-        buffer = bytearray()
+    @asyncio.coroutine
+    def _stream(self, resp):
+        readsize = self.readsize
         while True:
-            chunk = yield from resp.content.read(self.readsize)
+            chunk = yield from resp.content.read(readsize)
             if not chunk:
-                break
-            buffer.extend(chunk)
-            buffer, messages = self.get_messages(buffer)
-            if not messages: continue
-            for msg in messages:
+                return
+            self._attempts = 0
+            if len(chunk) == readsize and readsize < self.max_readsize:
+                readsize = min(2 * readsize, self.max_readsize)
+            for msg in self.get_messages(chunk):
                 if msg == None: continue
-                self.cb(msg, *self.args)
-
-    def get_messages(self, buffer):
-        messages = []
-        while self.delimiter in buffer:
-            chunks = buffer.split(self.delimiter)
-            messages.extend(chunks[:-1])
-            buffer = chunks[-1]
-        # decode messages into strings
-        messages = map(lambda x: x.decode(encoding='utf-8'), messages)
-        messages = map(lambda x: json.loads(x), messages)
-        return buffer, messages
+                try:
+                    self.cb(msg, *self.args)
+                except Exception:
+                    # a failing callback must not tear down the stream
+                    logger.exception("Subscription callback for {0} failed".format(self.query))
+
+    def get_messages(self, chunk):
+        """
+        Yields the decoded messages completed by the received chunk. Messages that do not
+        decode are logged and dropped
+        """
+        for msg in self._framer.feed(chunk):
+            try:
+                yield serializer.loads(msg)
+            except ValueError as e:
+                logger.warning("Dropped malformed message of subscription {0}: {1}".format(self.query, e))
+
+class SubscriptionManager(object):
+    """
+    The republish subscriptions of a driver. Callbacks subscribing to the same query share
+    one stream. With merge set, all queries to the same republish URL share a single stream
+    whose query is the disjunction of theirs; its messages are routed to callbacks through
+    a uuid -> callbacks index, built by asking the archiver at query_url which uuids each
+    query matches. If that fails, the queries get one stream each instead
+    """
+    def __init__(self, url, query_url=None, merge=False):
+        # default republish URL
+        self.url = url
+        self.query_url = query_url
+        self.merge = bool(merge and query_url)
+        # (republish url, query) -> [(callback, args)]
+        self._callbacks = {}
+        # (republish url, query) pairs in the order they were added
+        self._queries = []
+        # uuid -> [(callback, args)] for the merged streams
+        self._index = {}
+        # messages of merged streams from uuids missing in the index, waiting for it to be rebuilt
+        self._pending = []
+        self._refresh = None
+        # open streams
+        self.subscribers = []
+        self.session = None
+        self._started = False
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def status(self):
+        """
+        Returns (query, state, reconnects) for every open stream
+        """
+        return [(subscriber.query, subscriber.state, subscriber.reconnects) for subscriber in self.subscribers]
+
+    def add(self, query, callback, args=(), url=None):
+        """
+        Calls callback(message, *args) for every message republished for query
+        """
+        key = (url or self.url, query)
+        if key in self._callbacks:
+            self._callbacks[key].append((callback, args))
+            return
+        self._callbacks[key] = [(callback, args)]
+        self._queries.append(key)
+        if self._started:
+            # the merged streams are already open; this query gets its own
+            asyncio.ensure_future(self._open(*key))
+
+    def start(self, session):
+        """
+        Returns the coroutines running the streams for the queries added so far
+        """
+        self.session = session
+        self._started = True
+        if not self.merge:
+            return [self._open(url, query) for url, query in self._queries]
+        urls = []
+        for url, query in self._queries:
+            if url not in urls:
+                urls.append(url)
+        return [self._merged(url) for url in urls]
+
+    def _open(self, url, query):
+        subscriber = Subscriber(url, query, self._dispatch_query, args=[(url, query)], session=self.session)
+        self.subscribers.append(subscriber)
+        return subscriber.subscribe()
+
+    def _dispatch_query(self, msg, key):
+        for callback, args in self._callbacks[key]:
+            callback(msg, *args)
+
+    @asyncio.coroutine
+    def _merged(self, url):
+        queries = [query for qurl, query in self._queries if qurl == url]
+        try:
+            yield from self.resolve()
+        except Exception as e:
+            logger.warning("Could not resolve subscriptions through {0} ({1}), opening one stream per query".format(self.query_url, e))
+            yield from asyncio.gather(*[self._open(url, query) for query in queries])
+            return
+        logger.info("Merged {0} subscriptions to {1} into one stream".format(len(queries), url))
+        query = ' or '.join('({0})'.format(query) for query in queries)
+        subscriber = Subscriber(url, query, self._dispatch, session=self.session)
+        self.subscribers.append(subscriber)
+        yield from subscriber.subscribe()
+
+    @asyncio.coroutine
+    def resolve(self):
+        """
+        Rebuilds the uuid -> callbacks index by asking the archiver which uuids each query matches
+        """
+        index = {}
+        for key in self._queries:
+            response = yield from self.session.post(self.query_url, data="select uuid where {0}".format(key[1]))
+            try:
+                if response.status != 200:
+                    raise SubscriptionException("{0} answered {1}".format(self.query_url, response.status))
+                body = yield from response.read()
+            finally:
+                yield from response.release()
+            for doc in serializer.loads(body):
+                index.setdefault(doc['uuid'], []).extend(self._callbacks[key])
+        self._index = index
+
+    def _dispatch(self, msg):
+        if not isinstance(msg, dict) or 'uuid' not in msg:
+            return
+        callbacks = self._index.get(msg['uuid'])
+        if callbacks is None:
+            # a stream that started matching after the index was built
+            self._pending.append(msg)
+            if self._refresh is None:
+                self._refresh = asyncio.ensure_future(self._reresolve())
+            return
+        for callback, args in callbacks:
+            callback(msg, *args)
+
+    @asyncio.coroutine
+    def _reresolve(self):
+        try:
+            yield from self.resolve()
+        except Exception as e:
+            logger.warning("Could not resolve subscriptions through {0}: {1}".format(self.query_url, e))
+        finally:
+            pending, self._pending = self._pending, []
+            self._refresh = None
+        for msg in pending:
+            callbacks = self._index.get(msg['uuid'])
+            if callbacks is None:
+                logger.warning("No subscription matches {0}, dropping its message".format(msg['uuid']))
+                continue
+            for callback, args in callbacks:
+                callback(msg, *args)
@@ -0,0 +1,152 @@
+import os
+import glob
+import time
+import uuid
+import zlib
+import asyncio
+import logging
+import configparser
+import multiprocessing
+
+from XBOSDriver.host import DriverHost
+
+logger = logging.getLogger('driver')
+
+def shard_key(path):
+    """
+    Returns the integer an instance .ini is sharded by: its instance_uuid, or a hash of its
+    file name if it has none, so that an instance stays on the same worker across rescans
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(path)
+    if config.has_option('deployment', 'instance_uuid'):
+        try:
+            return uuid.UUID(config['deployment']['instance_uuid']).int
+        except ValueError:
+            pass
+    return zlib.crc32(os.path.basename(path).encode('utf-8'))
+
+def _work(paths, config):
+    """
+    Entry point of a worker process: hosts the given instances on a fresh event loop
+    """
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    DriverHost(None, config, paths).run()
+
+class Supervisor(object):
+    """
+    Shards the driver instances of every .ini file in a directory across worker processes,
+    each running its share on a DriverHost, so a fleet of instances can use every core.
+    Instances are assigned by instance_uuid modulo the number of workers. The directory is
+    rescanned every rescan seconds; when instances are added, removed or edited only the
+    workers whose share changed are restarted. Workers that exit are restarted after
+    restart_delay seconds
+    """
+    def __init__(self, directory, workers=None, config=None, rescan=30, restart_delay=5):
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        # options for the shared session of each worker, as taken by make_session
+        self.config = config if config is not None else {}
+        self.rescan = rescan
+        self.restart_delay = restart_delay
+        # worker index -> running multiprocessing.Process
+        self._processes = {}
+        # worker index -> (path, mtime) pairs of the instances it runs
+        self._shares = {}
+        # worker index -> time the worker was found dead
+        self._died = {}
+        # path -> (mtime, shard key), so unchanged files are not reparsed on every rescan
+        self._keys = {}
+
+    def assign(self):
+        """
+        Scans the directory and returns {worker index: frozenset of (path, mtime)}. Files that
+        do not parse are left out until they do
+        """
+        shares = {index: set() for index in range(self.workers)}
+        keys = {}
+        for path in glob.glob(os.path.join(self.directory, '*.ini')):
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            cached = self._keys.get(path)
+            if cached is not None and cached[0] == mtime:
+                key = cached[1]
+            else:
+                try:
+                    key = shard_key(path)
+                except configparser.Error as e:
+                    # malformed or still being written; picked up once it parses
+                    logger.warning("Skipping {0}: {1}".format(path, e))
+                    continue
+            keys[path] = (mtime, key)
+            shares[key % self.workers].add((path, mtime))
+        self._keys = keys
+        return {index: frozenset(share) for index, share in shares.items()}
+
+    def _spawn(self, index):
+        share = self._shares.get(index)
+        if not share:
+            return
+        paths = [path for path, mtime in share]
+        process = multiprocessing.Process(target=_work, args=(paths, self.config),
+                                          name='xbos-driver-{0}'.format(index))
+        process.start()
+        logger.info("Started worker {0} (pid {1}) with {2} instances".format(index, process.pid, len(paths)))
+        self._processes[index] = process
+
+    def _stop(self, index):
+        process = self._processes.pop(index, None)
+        if process is None:
+            return
+        process.terminate()
+        process.join()
+
+    def rebalance(self):
+        """
+        Rescans the directory and restarts the workers whose share of instances changed
+        """
+        for index, share in self.assign().items():
+            if share == self._shares.get(index):
+                continue
+            if index in self._shares:
+                logger.info("Instances of worker {0} changed, restarting it".format(index))
+            self._stop(index)
+            self._shares[index] = share
+            self._died.pop(index, None)
+            self._spawn(index)
+
+    def check(self):
+        """
+        Restarts workers that exited, restart_delay seconds after noticing
+        """
+        now = time.monotonic()
+        for index, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            if index not in self._died:
+                logger.error("Worker {0} (pid {1}) exited with {2}".format(index, process.pid, process.exitcode))
+                self._died[index] = now
+            elif now - self._died[index] >= self.restart_delay:
+                del self._died[index]
+                del self._processes[index]
+                self._spawn(index)
+
+    def run(self):
+        """
+        Starts the workers and keeps them running until interrupted
+        """
+        logger.info("Supervising {0} with {1} workers".format(self.directory, self.workers))
+        try:
+            lastscan = None
+            while True:
+                if lastscan is None or time.monotonic() - lastscan >= self.rescan:
+                    self.rebalance()
+                    lastscan = time.monotonic()
+                self.check()
+                time.sleep(1)
+        finally:
+            for index in list(self._processes):
+                self._stop(index)
@@ -1,6 +1,8 @@
 from datetime import datetime
+import xml.etree.ElementTree as ET
 
 from XBOSDriver.timeseriestypes import UNIT_TIMES
+from XBOSDriver.exceptions import TimestampException
 from XBOSDriver.timeseriestypes import UNIT_TIME_SECONDS, UNIT_TIME_MILLISECONDS, \
                   UNIT_TIME_MICROSECONDS, UNIT_TIME_NANOSECONDS
 
@@ -11,13 +13,16 @@ UNIT_TIME_LOOKUP = {
     UNIT_TIME_NANOSECONDS: 1e9
 }
 
-def get_current_time_as(time_unit):
+def get_current_time_as(time_unit, now=None):
     """
-    Returns current time in the given units. Uses local timezone
+    Returns current time in the given units. Uses local timezone. If now (a POSIX
+    timestamp in seconds) is given, it is converted instead of reading the clock
     """
     if time_unit not in UNIT_TIME_LOOKUP:
         raise TimestampException("Unit of Time {0} not in {1}".format(time_unit, UNIT_TIME_LOOKUP))
-    return int(datetime.now().timestamp() * UNIT_TIME_LOOKUP[time_unit])
+    if now is None:
+        now = datetime.now().timestamp()
+    return int(now * UNIT_TIME_LOOKUP[time_unit])
 
 def buildkv(fullname, obj, separator='/'):
     if isinstance(obj, dict):
@@ -60,3 +65,171 @@ def dict_merge(o1, o2):
             o2[k] = v
     return o2
 
+
+def dict_diff(new, old):
+    """Returns the parts of dict new that are missing from or differ in dict old,
+    recursing into nested dicts.
+    """
+    diff = {}
+    for k, v in new.items():
+        if k not in old:
+            diff[k] = v
+            continue
+        oldv = old[k]
+        if v is oldv:
+            continue
+        if isinstance(v, dict) and isinstance(oldv, dict):
+            subdiff = dict_diff(v, oldv)
+            if subdiff:
+                diff[k] = subdiff
+        elif v != oldv:
+            diff[k] = v
+    return diff
+
+
+class XMLIngest(object):
+    """Maps the elements of XML responses straight to timeseries readings in one pass, without
+    building a tree of the whole document. Elements are named by their tag path from the
+    document root, e.g. 'response/pow1', or by tag alone at any depth, e.g. '//device'.
+
+        ingest = XMLIngest()
+        ingest.bind('response/pow1', driver.add_timeseries('/plug/1/power', 'W', 'milliseconds', 'numeric'), float)
+        ingest.on('//device', lambda elem: [('/light/' + elem.findtext('did'), int(elem.findtext('state')))])
+        driver.add_many(ingest.parse(body))
+
+    bind converts the text of an element into a reading of the given timeseries. on calls
+    a callback with the element and its subtree, which is only built for such elements; the
+    callback returns the (path, value) readings it yields, if any.
+    """
+    def __init__(self):
+        # tag path tuple -> binding, and tag -> binding for elements bound at any depth
+        self._bindings, self._bindings_anywhere = {}, {}
+        self._callbacks, self._callbacks_anywhere = {}, {}
+
+    @staticmethod
+    def _register(exact, anywhere, element, value):
+        if element.startswith('//'):
+            anywhere[element[2:]] = value
+        else:
+            exact[tuple(element.strip('/').split('/'))] = value
+
+    def bind(self, element, timeseries, convert=float):
+        """Binds an element to a timeseries, given as the TimeseriesHandle returned by
+        Driver.add_timeseries, a Timeseries or a path. Readings are keyed by what is bound, so
+        those of a handle or Timeseries reach its buffer without a path lookup in add_many
+        """
+        self._register(self._bindings, self._bindings_anywhere, element, (timeseries, convert))
+
+    def on(self, element, callback):
+        self._register(self._callbacks, self._callbacks_anywhere, element, callback)
+
+    def _binding(self, key):
+        return self._bindings.get(key) or self._bindings_anywhere.get(key[-1])
+
+    def _callback(self, key):
+        return self._callbacks.get(key) or self._callbacks_anywhere.get(key[-1])
+
+    def stream(self, fragments=False):
+        """Returns an XMLStream to feed a response into as it arrives. With fragments set, the
+        response may be a series of elements without a common root
+        """
+        return XMLStream(self, fragments)
+
+    def parse(self, data, fragments=False):
+        """Returns the readings of a complete response
+        """
+        stream = self.stream(fragments)
+        stream.feed(data)
+        return stream.close()
+
+class XMLStream(object):
+    """Incremental parse of one response through an XMLIngest. Tracks the depth of the element
+    being parsed and the top-level elements completed, so that callers reading from a socket
+    can tell when a response is complete
+    """
+    def __init__(self, ingest, fragments=False):
+        self._ingest = ingest
+        self._parser = ET.XMLParser(target=_XMLTarget(self))
+        # tags of the open elements
+        self._stack = []
+        self._text = []
+        # builds the subtree of an element with a callback, opened at depth _subtree_depth
+        self._subtree = None
+        self._subtree_depth = 0
+        self._fragments = fragments
+        # whether the synthetic root the fragments are parsed under is yet to be opened
+        self._root = fragments
+        # readings produced so far
+        self.readings = []
+        # top-level elements completed so far, and the tag of the last one
+        self.count = 0
+        self.last = None
+        if fragments:
+            self._parser.feed(b'<xml>')
+
+    @property
+    def depth(self):
+        return len(self._stack)
+
+    def feed(self, data):
+        self._parser.feed(data)
+
+    def close(self):
+        """Finishes the parse and returns the readings
+        """
+        if self._fragments:
+            self._parser.feed(b'</xml>')
+        self._parser.close()
+        return self.readings
+
+    def _start(self, tag, attrib):
+        if self._root:
+            self._root = False
+            return
+        self._stack.append(tag)
+        del self._text[:]
+        if self._subtree is not None:
+            self._subtree.start(tag, attrib)
+        elif self._ingest._callback(tuple(self._stack)) is not None:
+            self._subtree = ET.TreeBuilder()
+            self._subtree.start(tag, attrib)
+            self._subtree_depth = len(self._stack)
+
+    def _data(self, data):
+        self._text.append(data)
+        if self._subtree is not None:
+            self._subtree.data(data)
+
+    def _end(self, tag):
+        if not self._stack:
+            # closing the synthetic root
+            return
+        key = tuple(self._stack)
+        text = ''.join(self._text).strip()
+        del self._text[:]
+        binding = self._ingest._binding(key)
+        if binding is not None and text:
+            timeseries, convert = binding
+            self.readings.append((timeseries, convert(text)))
+        if self._subtree is not None:
+            self._subtree.end(tag)
+            if len(self._stack) == self._subtree_depth:
+                elem = self._subtree.close()
+                self._subtree = None
+                readings = self._ingest._callback(key)(elem)
+                if readings:
+                    self.readings.extend(readings)
+        self._stack.pop()
+        if not self._stack:
+            self.count += 1
+            self.last = tag
+
+class _XMLTarget(object):
+    # XMLParser target handing the parse events to an XMLStream
+    def __init__(self, stream):
+        self.start = stream._start
+        self.data = stream._data
+        self.end = stream._end
+
+    def close(self):
+        pass